@@ -0,0 +1,104 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import numpy as np
+from backend.resources import get_embeddings
+
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1024"))              # 0 disables the cache
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))  # cosine similarity for a hit
+
+def scope_key(**params) -> str:
+    """
+    Hashes everything besides the question that shapes an answer
+    (retrieval parameters, conversation history); only questions with the
+    same scope can share an answer.
+    """
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()
+
+class AnswerCache:
+    """
+    Answers keyed by question embedding. A lookup returns the stored
+    answer of the most similar earlier question in the same scope if the
+    cosine similarity reaches `threshold`; the scan is one matrix-vector
+    product over at most `size` rows.
+
+    Entries carry the corpus version they were answered against.
+    invalidate() bumps the version and drops everything, and store()
+    ignores answers computed against an older version, so a question that
+    raced an ingest is never cached.
+    """
+
+    def __init__(self, size: int = ANSWER_CACHE_SIZE, threshold: float = ANSWER_CACHE_THRESHOLD):
+        self.size = size
+        self.threshold = threshold
+        self.version = 0
+        self._vectors = None                          # (size, dim), allocated on first store
+        self._scopes = np.empty(size, dtype=object)
+        self._used = np.zeros(size)                   # last hit/store time; 0 marks a free row
+        self._entries = [None] * size
+        self._lock = threading.Lock()
+        self.stats_counter = {"hits": 0, "misses": 0, "stores": 0, "invalidations": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0
+
+    def embed(self, question: str):
+        vector = np.asarray(get_embeddings().embed_query(question), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, vector, scope: str):
+        """Returns {"answer", "sources", "similarity"} or None."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            if self._vectors is None:
+                self.stats_counter["misses"] += 1
+                return None
+            similarity = self._vectors @ vector
+            similarity[(self._used == 0) | (self._scopes != scope)] = -np.inf
+            best = int(np.argmax(similarity))
+            if similarity[best] < self.threshold:
+                self.stats_counter["misses"] += 1
+                return None
+            self._used[best] = time.time()
+            self.stats_counter["hits"] += 1
+            return {**self._entries[best], "similarity": float(similarity[best])}
+
+    def store(self, vector, scope: str, version: int, answer: str, sources):
+        if not self.enabled:
+            return
+        with self._lock:
+            if version != self.version:
+                return
+            if self._vectors is None:
+                self._vectors = np.zeros((self.size, len(vector)), dtype=np.float32)
+            row = int(np.argmin(self._used))   # a free row, else the least recently used
+            self._vectors[row] = vector
+            self._scopes[row] = scope
+            self._used[row] = time.time()
+            self._entries[row] = {"answer": answer, "sources": sources}
+            self.stats_counter["stores"] += 1
+
+    def invalidate(self):
+        with self._lock:
+            self.version += 1
+            self._used[:] = 0
+            self._scopes[:] = None
+            self._entries = [None] * self.size
+            self.stats_counter["invalidations"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self.stats_counter,
+                "entries": int(np.count_nonzero(self._used)),
+                "size": self.size,
+                "threshold": self.threshold,
+                "version": self.version,
+            }
+
+answer_cache = AnswerCache()
@@ -0,0 +1,198 @@
+import os
+import time
+import uuid
+import shutil
+import zipfile
+import logging
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from fastapi import Request
+from backend.extraction import SUPPORTED_EXTENSIONS
+from backend.uploads import (MAX_UPLOAD_MB, MAX_UPLOAD_BYTES, MAX_BATCH_UPLOAD_BYTES, parse_tags, receive_form,
+                             too_large, unique_path)
+from backend.ingestion import index_documents
+from backend.preparation import extract_file
+
+logger = logging.getLogger(__name__)
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(os.cpu_count() or 2)))
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))   # documents per embedding/index write
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# job_id -> status dict (see IngestJobStatus)
+_jobs = {}
+_jobs_lock = threading.Lock()
+_executor = None
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # spawn: workers must not inherit the parent's HTTP pools / sqlite handles
+        _executor = ProcessPoolExecutor(max_workers=INGEST_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+def _reset_executor():
+    # A crashed worker poisons the pool; the next submit gets a fresh one
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+    _executor = None
+
+def shutdown():
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+
+# ---------- Staging ----------
+def _copy_limited(src, dst, limit: int) -> int:
+    """Copies src to dst; returns the bytes written, or -1 once more than `limit` arrived."""
+    written = 0
+    while True:
+        chunk = src.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            return written
+        written += len(chunk)
+        if written > limit:
+            return -1
+        dst.write(chunk)
+
+def _expand_zip(zip_path: str, directory: str, budget: int):
+    """
+    Extracts supported members; directory components are dropped. Returns
+    (staged, failed, bytes written). Sizes are counted as members
+    decompress, never taken from the archive's headers: a member over
+    MAX_UPLOAD_BYTES is a failed file, and going over `budget` in total
+    raises 413.
+    """
+    staged, failed, used = [], [], 0
+    with zipfile.ZipFile(zip_path) as archive:
+        for member in archive.infolist():
+            name = os.path.basename(member.filename)
+            if member.is_dir() or not name.lower().endswith(SUPPORTED_EXTENSIONS):
+                continue
+            path = unique_path(directory, name)
+            limit = min(MAX_UPLOAD_BYTES, budget - used)
+            with archive.open(member) as src, open(path, "wb") as dst:
+                written = _copy_limited(src, dst, limit)
+            if written < 0:
+                os.remove(path)
+                if limit < MAX_UPLOAD_BYTES:
+                    raise too_large(MAX_BATCH_UPLOAD_BYTES)
+                failed.append({"file": name, "error": f"Exceeds {MAX_UPLOAD_MB:g} MB"})
+                continue
+            used += written
+            staged.append((path, name))
+    os.remove(zip_path)
+    return staged, failed, used
+
+async def stage_uploads(request: Request) -> str:
+    """
+    Streams the uploaded files of a multipart request (and the contents
+    of any .zip) into a job directory and registers a queued job. Returns
+    the job id. The optional `tags` field applies to every document of
+    the job. Size limits are enforced while the body streams in, and on
+    the bytes zip members decompress to.
+    """
+    job_id = uuid.uuid4().hex
+    workdir = tempfile.mkdtemp(prefix=f"ingest-{job_id}-")
+    try:
+        uploads, fields = await receive_form(request, workdir, max_file_bytes=MAX_UPLOAD_BYTES,
+                                             max_body_bytes=MAX_BATCH_UPLOAD_BYTES)
+        tags = parse_tags(fields.get("tags"))
+        zips = [u for u in uploads if u.filename.lower().endswith(".zip")]
+        # Extracted members share the batch limit with the files sent as-is
+        budget = MAX_BATCH_UPLOAD_BYTES - sum(u.size for u in uploads if u not in zips)
+        staged, skipped = [], []
+        for upload in uploads:
+            if upload in zips:
+                members, failed, used = _expand_zip(upload.path, workdir, budget)
+                staged.extend(members)
+                skipped.extend(failed)
+                budget -= used
+            elif upload.filename.lower().endswith(SUPPORTED_EXTENSIONS):
+                staged.append((upload.path, upload.filename))
+            else:
+                os.remove(upload.path)
+                skipped.append({"file": upload.filename, "error": "Unsupported file type"})
+    except BaseException:
+        shutil.rmtree(workdir, ignore_errors=True)
+        raise
+
+    with _jobs_lock:
+        _jobs[job_id] = {
+            "job_id": job_id,
+            "status": "queued",
+            "total": len(staged),
+            "extracted": 0,
+            "indexed": 0,
+            "failed": skipped,
+            "created_at": time.time(),
+            "finished_at": None,
+            "_workdir": workdir,
+            "_files": staged,
+            "_tags": tags,
+        }
+    return job_id
+
+def get_job(job_id: str):
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job is None:
+            return None
+        return {k: v for k, v in job.items() if not k.startswith("_")}
+
+def _update(job_id: str, **changes):
+    with _jobs_lock:
+        _jobs[job_id].update(changes)
+
+# ---------- Processing ----------
+def run_job(job_id: str):
+    """
+    Extracts every staged file in the process pool and indexes the results
+    in batches of EMBED_BATCH_SIZE as they complete. Meant to run in a
+    background thread.
+    """
+    with _jobs_lock:
+        job = _jobs[job_id]
+        files, workdir, tags = job["_files"], job["_workdir"], job["_tags"]
+    _update(job_id, status="running")
+    started = time.perf_counter()
+    batch, extracted, indexed, failed = [], 0, 0, list(job["failed"])
+
+    def flush_batch():
+        nonlocal batch, indexed
+        index_documents(batch, tags=tags)
+        indexed += len(batch)
+        batch = []
+        _update(job_id, indexed=indexed)
+
+    try:
+        executor = _get_executor()
+        futures = {executor.submit(extract_file, path, name): name for path, name in files}
+        for future in as_completed(futures):
+            try:
+                doc = future.result()
+                batch.append(doc)
+                extracted += 1
+            except BrokenProcessPool as e:
+                _reset_executor()
+                failed.append({"file": futures[future], "error": str(e)})
+            except Exception as e:
+                failed.append({"file": futures[future], "error": str(e)})
+            _update(job_id, extracted=extracted, failed=list(failed))
+            if len(batch) >= EMBED_BATCH_SIZE:
+                flush_batch()
+        if batch:
+            flush_batch()
+        _update(job_id, status="completed")
+    except Exception as e:
+        logger.exception("ingest_batch job %s failed", job_id)
+        failed.append({"file": None, "error": str(e)})
+        _update(job_id, status="failed", failed=list(failed))
+    finally:
+        _update(job_id, finished_at=time.time())
+        shutil.rmtree(workdir, ignore_errors=True)
+        logger.info("ingest_batch job %s: %d/%d files indexed in %.1fs",
+                    job_id, indexed, len(files), time.perf_counter() - started)
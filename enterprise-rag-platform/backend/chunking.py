@@ -0,0 +1,96 @@
+import os
+import re
+import hashlib
+from backend.tokens import count_tokens, split_tokens
+
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "400"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "60"))
+
+# Sentence ends followed by whitespace, or paragraph breaks
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+|\n\s*\n")
+
+def iter_sentences(text: str):
+    """Yields (offset, sentence) with offsets into text."""
+    start = 0
+    for m in _SENTENCE_BOUNDARY.finditer(text):
+        piece = text[start:m.start()]
+        if piece.strip():
+            yield start + len(piece) - len(piece.lstrip()), piece.strip()
+        start = m.end()
+    piece = text[start:]
+    if piece.strip():
+        yield start + len(piece) - len(piece.lstrip()), piece.strip()
+
+def doc_key(filename: str) -> str:
+    return hashlib.sha1(filename.encode("utf-8")).hexdigest()[:12]
+
+def chunk_id(key: str, text: str) -> str:
+    """
+    Stable, content-addressed chunk id shared by Chroma and the sparse
+    index: the same text in the same file always gets the same id.
+    """
+    return f"{key}-{hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]}"
+
+def chunk_segments(segments, filename: str, max_tokens: int = CHUNK_TOKENS, overlap: int = CHUNK_OVERLAP_TOKENS):
+    """
+    Splits extraction Segments (page, offset, text) into chunks of at most
+    max_tokens tokens, yielding each chunk as soon as it is complete.
+    Chunks end on sentence boundaries and never span pages; consecutive
+    chunks on a page share up to `overlap` tokens of trailing sentences.
+    Sentences longer than max_tokens are split on tokens.
+
+    Yields dicts with id, filename, page, offset, index, text and tokens.
+    Repeated chunks within one document are kept once.
+    """
+    key = doc_key(filename)
+    seen = set()
+    index = 0
+
+    def make_chunk(page, window):
+        nonlocal index
+        text = " ".join(s for _, s, _ in window)
+        cid = chunk_id(key, text)
+        if cid in seen:
+            return None
+        seen.add(cid)
+        index += 1
+        return {
+            "id": cid,
+            "filename": filename,
+            "page": page,
+            "offset": window[0][0],
+            "index": index - 1,
+            "text": text,
+            "tokens": sum(n for _, _, n in window),
+        }
+
+    window, size, fresh, page = [], 0, False, None
+    for seg in segments:
+        if seg.page != page:
+            if fresh and (chunk := make_chunk(page, window)):
+                yield chunk
+            window, size, fresh, page = [], 0, False, seg.page
+        for start, sentence in iter_sentences(seg.text):
+            offset = seg.offset + start
+            n = count_tokens(sentence)
+            pieces = [(sentence, n)] if n <= max_tokens else \
+                [(p, count_tokens(p)) for p in split_tokens(sentence, max_tokens, overlap)]
+            for piece, n in pieces:
+                if fresh and size + n > max_tokens:
+                    if chunk := make_chunk(page, window):
+                        yield chunk
+                    # Carry trailing sentences forward as overlap
+                    carry, carried = [], 0
+                    for item in reversed(window):
+                        if carried + item[2] > overlap:
+                            break
+                        carry.insert(0, item)
+                        carried += item[2]
+                    window, size, fresh = carry, carried, False
+                while window and size + n > max_tokens:
+                    size -= window.pop(0)[2]
+                window.append((offset, piece, n))
+                size += n
+                fresh = True
+    if fresh and (chunk := make_chunk(page, window)):
+        yield chunk
@@ -0,0 +1,79 @@
+import os
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import HTTPException
+
+# Per endpoint class: how many requests run at once, how many may wait for
+# a slot, and how long (seconds) a waiting request waits before giving up
+INGEST_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", "2"))
+INGEST_QUEUE = int(os.getenv("INGEST_QUEUE", "4"))
+QUERY_CONCURRENCY = int(os.getenv("QUERY_CONCURRENCY", "8"))
+QUERY_QUEUE = int(os.getenv("QUERY_QUEUE", "16"))
+QUEUE_TIMEOUT = float(os.getenv("QUEUE_TIMEOUT", "5"))
+
+class Limiter:
+    """
+    Bounds concurrent work for one endpoint class. When every slot is busy
+    a request waits in a short queue; a full queue is rejected at once with
+    429 and a wait longer than `timeout` ends in 503. Use from the event
+    loop only.
+    """
+
+    def __init__(self, name: str, limit: int, queue: int, timeout: float = QUEUE_TIMEOUT):
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.timeout = timeout
+        self._slots = asyncio.Semaphore(limit)
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def _busy(self, status: int, detail: str):
+        return HTTPException(status_code=status, detail=detail, headers={"Retry-After": str(max(1, round(self.timeout)))})
+
+    async def acquire(self):
+        if self._slots.locked():
+            if self.waiting >= self.queue:
+                self.rejected += 1
+                raise self._busy(429, f"Too many {self.name} requests, try again later")
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.timeout)
+            except asyncio.TimeoutError:
+                self.timed_out += 1
+                raise self._busy(503, f"{self.name.capitalize()} capacity exhausted, try again later")
+            finally:
+                self.waiting -= 1
+        else:
+            await self._slots.acquire()
+        self.active += 1
+
+    def release(self):
+        self.active -= 1
+        self._slots.release()
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "queue": self.queue,
+            "active": self.active,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+        }
+
+ingest_limiter = Limiter("ingest", INGEST_CONCURRENCY, INGEST_QUEUE)
+query_limiter = Limiter("query", QUERY_CONCURRENCY, QUERY_QUEUE)
+
+def stats() -> dict:
+    return {"ingest": ingest_limiter.stats(), "query": query_limiter.stats()}
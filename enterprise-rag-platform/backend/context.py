@@ -0,0 +1,100 @@
+import os
+import re
+import threading
+from backend.chunking import iter_sentences
+from backend.resources import VECTOR_BACKEND, get_vector_store
+from backend.tokens import count_tokens
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2000"))   # retrieved-context tokens per prompt
+MIN_TRIM_TOKENS = 32   # a trimmed chunk shorter than this is dropped rather than sent
+
+_SPACE = re.compile(r"\s+")
+
+# ---------- Chunk text ----------
+def chunk_texts(ids) -> dict:
+    """Full text of the given chunk ids ({id: text}); ids no longer stored are left out."""
+    ids = [i for i in ids if i]
+    if not ids:
+        return {}
+    vectordb = get_vector_store()
+    if VECTOR_BACKEND == "chroma":
+        found = vectordb.get(ids=ids, include=["documents"])
+        return dict(zip(found["ids"], found["documents"]))
+    return {doc.id: doc.page_content for doc in vectordb.get_by_ids(ids)}
+
+def _header(n: int, source: dict) -> str:
+    page = source.get("page")
+    return f"[{n}] {source.get('filename', 'unknown')}" + (f" (page {page})" if page is not None else "")
+
+# ---------- Packing ----------
+_stats = {"packed": 0, "chunks_in": 0, "chunks_packed": 0, "chunks_trimmed": 0,
+          "overlap_sentences": 0, "tokens": 0}
+_lock = threading.Lock()
+
+def pack_context(sources, texts: dict = None, budget: int = CONTEXT_TOKEN_BUDGET):
+    """
+    Packs ranked sources (best first) into one context string of at most
+    `budget` tokens and returns (context, packed sources).
+
+    Each chunk's full text (from `texts`, by chunk id; the preview when it
+    is missing) is split into sentences, and sentences already packed from
+    a higher-ranked chunk are dropped, so the overlap consecutive chunks
+    share is sent once. Chunks are then added whole while they fit; the
+    first one that doesn't is cut to its leading sentences that do, and
+    packing continues with the rest in case a shorter chunk still fits.
+    """
+    texts = texts or {}
+    seen = set()
+    blocks, packed = [], []
+    used = 0
+    overlap = trimmed = 0
+    for source in sources:
+        text = texts.get(source.get("id")) or source.get("preview", "")
+        sentences = []
+        for _, sentence in iter_sentences(text):
+            key = _SPACE.sub(" ", sentence).casefold()
+            if key in seen:
+                overlap += 1
+                continue
+            sentences.append((key, sentence))
+        if not sentences:
+            continue
+
+        header = _header(len(packed) + 1, source)
+        cost = count_tokens(header) + 1
+        keep = []
+        for key, sentence in sentences:
+            tokens = count_tokens(sentence) + 1
+            if used + cost + tokens > budget:
+                break
+            keep.append((key, sentence))
+            cost += tokens
+        if len(keep) < len(sentences):
+            if cost < MIN_TRIM_TOKENS or not keep:
+                continue
+            trimmed += 1
+
+        seen.update(key for key, _ in keep)
+        blocks.append(header + "\n" + " ".join(sentence for _, sentence in keep))
+        packed.append(source)
+        used += cost
+
+    with _lock:
+        _stats["packed"] += 1
+        _stats["chunks_in"] += len(sources)
+        _stats["chunks_packed"] += len(packed)
+        _stats["chunks_trimmed"] += trimmed
+        _stats["overlap_sentences"] += overlap
+        _stats["tokens"] += used
+    return "\n\n".join(blocks), packed
+
+def build_context(sources, budget: int = CONTEXT_TOKEN_BUDGET):
+    """pack_context over the full stored text of the sources."""
+    return pack_context(sources, chunk_texts([s.get("id") for s in sources]), budget)
+
+def context_stats() -> dict:
+    with _lock:
+        stats = dict(_stats)
+    stats["budget"] = CONTEXT_TOKEN_BUDGET
+    stats["avg_tokens"] = round(stats["tokens"] / stats["packed"], 1) if stats["packed"] else 0.0
+    return stats
@@ -0,0 +1,158 @@
+import os
+import sqlite3
+import hashlib
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import List
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+EMBEDDING_CACHE_DB = os.getenv("EMBEDDING_CACHE_DB", "embedding_cache.db")
+EMBEDDING_CACHE_MEMORY_SIZE = int(os.getenv("EMBEDDING_CACHE_MEMORY_SIZE", "4096"))
+EMBEDDING_CACHE_MAX_ROWS = int(os.getenv("EMBEDDING_CACHE_MAX_ROWS", "200000"))
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def _as_float32(vector) -> List[float]:
+    # Round once on the way in so memory and disk hits return identical vectors
+    return np.asarray(vector, dtype=np.float32).tolist()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an Embeddings implementation with a two-tier cache: an in-memory
+    LRU in front of a size-bounded SQLite table. Entries are keyed by the
+    embedding model and the whitespace-normalized text, so a repeated
+    question or chunk is never sent to the provider twice.
+    """
+
+    def __init__(self, embeddings: Embeddings, model: str, path: str = EMBEDDING_CACHE_DB,
+                 memory_size: int = EMBEDDING_CACHE_MEMORY_SIZE, max_rows: int = EMBEDDING_CACHE_MAX_ROWS):
+        self.embeddings = embeddings
+        self.model = model
+        self.memory_size = memory_size
+        self.max_rows = max_rows
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats_counter = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)")
+        self._db.commit()
+        self._rows = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    # ---------- Tiers ----------
+    def _remember(self, key: str, vector: List[float]):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def _lookup(self, keys):
+        """Returns {key: vector} for every key found in either tier."""
+        found = {}
+        missing = []
+        with self._lock:
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[key] = vector
+                    self.stats_counter["memory_hits"] += 1
+                else:
+                    missing.append(key)
+            rows = []
+            # Stay under SQLite's bound-parameter limit for large batches
+            for i in range(0, len(missing), 500):
+                part = missing[i:i + 500]
+                placeholders = ",".join("?" * len(part))
+                rows.extend(self._db.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", part
+                ).fetchall())
+            for key, blob in rows:
+                vector = np.frombuffer(blob, dtype=np.float32).tolist()
+                found[key] = vector
+                self._remember(key, vector)
+                self.stats_counter["disk_hits"] += 1
+            if rows:
+                self._db.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(time.time(), key) for key, _ in rows],
+                )
+                self._db.commit()
+        return found
+
+    def _store(self, items):
+        now = time.time()
+        with self._lock:
+            for key, vector in items:
+                self._remember(key, vector)
+            cur = self._db.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [(key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in items],
+            )
+            self._rows += cur.rowcount
+            if self._rows > self.max_rows:
+                # Evict the least recently used tenth in one statement
+                evict = self._rows - self.max_rows + self.max_rows // 10
+                self._db.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (evict,)
+                )
+                self._rows -= evict
+                self.stats_counter["evictions"] += evict
+            self._db.commit()
+
+    # ---------- Embeddings interface ----------
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(t) for t in texts]
+        found = self._lookup(dict.fromkeys(keys))
+        # Embed each distinct miss once, in a single provider call
+        pending = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in pending:
+                pending[key] = text
+        if pending:
+            with self._lock:
+                self.stats_counter["misses"] += len(pending)
+            vectors = self.embeddings.embed_documents(list(pending.values()))
+            new = [(key, _as_float32(v)) for key, v in zip(pending.keys(), vectors)]
+            self._store(new)
+            found.update(new)
+        return [found[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        found = self._lookup([key])
+        if key in found:
+            return found[key]
+        with self._lock:
+            self.stats_counter["misses"] += 1
+        vector = _as_float32(self.embeddings.embed_query(text))
+        self._store([(key, vector)])
+        return vector
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = sum(self.stats_counter[k] for k in ("memory_hits", "disk_hits", "misses"))
+            hits = self.stats_counter["memory_hits"] + self.stats_counter["disk_hits"]
+            return {
+                **self.stats_counter,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "memory_size": self.memory_size,
+                "disk_entries": self._rows,
+                "max_rows": self.max_rows,
+            }
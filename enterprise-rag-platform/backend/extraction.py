@@ -0,0 +1,98 @@
+import io
+import os
+from collections import namedtuple
+from docx import Document
+import pdfplumber
+
+SUPPORTED_EXTENSIONS = (".pdf", ".docx", ".txt")
+PREVIEW_CHARS = 300
+
+# page: 1-based page number (always 1 for DOCX/TXT)
+# offset: character offset of text in the document, pages/paragraphs joined by "\n"
+Segment = namedtuple("Segment", ["page", "offset", "text"])
+
+def _open_source(source):
+    """Bytes become an in-memory file; paths and file objects pass through."""
+    if isinstance(source, (bytes, bytearray)):
+        return io.BytesIO(source)
+    return source
+
+# ---------- Per-format readers ----------
+def _iter_pdf(source):
+    with pdfplumber.open(source) as pdf:
+        for number, page in enumerate(pdf.pages, start=1):
+            text = page.extract_text()
+            # Drop the parsed layout objects before moving to the next page
+            page.close()
+            yield number, text
+
+def _iter_docx(source):
+    for para in Document(source).paragraphs:
+        yield 1, para.text
+
+def _iter_txt(source):
+    if isinstance(source, (str, os.PathLike)):
+        f = open(source, "r", encoding="utf-8", errors="ignore")
+    else:
+        f = io.TextIOWrapper(source, encoding="utf-8", errors="ignore")
+    with f:
+        # One paragraph at a time
+        paragraph = []
+        for line in f:
+            if line.strip():
+                paragraph.append(line.rstrip("\n"))
+            elif paragraph:
+                yield 1, "\n".join(paragraph)
+                paragraph = []
+        if paragraph:
+            yield 1, "\n".join(paragraph)
+
+_READERS = {".pdf": _iter_pdf, ".docx": _iter_docx, ".txt": _iter_txt}
+
+def iter_segments(source, filename: str):
+    """
+    Parses a file once and yields Segments (PDF pages, DOCX/TXT
+    paragraphs) as they are read. `source` may be bytes, a path or a
+    binary file object. Empty pages/paragraphs are skipped.
+    """
+    ext = os.path.splitext(filename.lower())[1]
+    reader = _READERS.get(ext)
+    if reader is None:
+        raise ValueError(f"Unsupported file type: {filename}")
+    offset = 0
+    for page, text in reader(_open_source(source)):
+        text = (text or "").strip()
+        if not text:
+            continue
+        yield Segment(page, offset, text)
+        offset += len(text) + 1
+
+class PreviewTap:
+    """
+    Passes segments through unchanged while keeping the first
+    PREVIEW_CHARS characters, so the preview comes from the same pass as
+    the chunks.
+    """
+
+    def __init__(self, segments, limit: int = PREVIEW_CHARS):
+        self.segments = segments
+        self.limit = limit
+        self.pages = 0
+        self._parts = []
+        self._size = 0
+        self._last_page = None
+
+    def __iter__(self):
+        for seg in self.segments:
+            if self._size < self.limit:
+                part = seg.text[:self.limit - self._size]
+                self._parts.append(part)
+                self._size += len(part) + 1
+            if seg.page != self._last_page:
+                self.pages += 1
+                self._last_page = seg.page
+            yield seg
+
+    @property
+    def preview(self) -> str:
+        return "\n".join(self._parts)[:self.limit]
@@ -1,12 +1,32 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, Boolean
+import os
+import time
+import hashlib
+import logging
+import threading
+from sqlalchemy import create_engine, event, inspect, insert, text, Column, Integer, String, Text, Boolean, Float, Index
 from sqlalchemy.orm import sessionmaker, declarative_base
 
+logger = logging.getLogger(__name__)
+
 DATABASE_URL = "sqlite:///feedback.db"
+FEEDBACK_BATCH_SIZE = int(os.getenv("FEEDBACK_BATCH_SIZE", "200"))             # flush once this many rows are queued
+FEEDBACK_FLUSH_INTERVAL = float(os.getenv("FEEDBACK_FLUSH_INTERVAL", "2"))     # ... or after this many seconds
 
 engine = create_engine(DATABASE_URL)
 SessionLocal = sessionmaker(bind=engine)
 Base = declarative_base()
 
+@event.listens_for(engine, "connect")
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets analytics read while batches are written; NORMAL syncs on checkpoints only
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+def query_hash(query: str) -> str:
+    return hashlib.sha256(" ".join(query.lower().split()).encode("utf-8")).hexdigest()
+
 class Feedback(Base):
     __tablename__ = "feedback"
 
@@ -15,14 +35,112 @@ class Feedback(Base):
     answer = Column(Text, nullable=False)
     is_helpful = Column(Boolean, nullable=False)
     sources = Column(Text)  # JSON string of sources
+    query_hash = Column(String(64))   # sha256 of the case/whitespace-normalized query
+    created_at = Column(Float)
+
+    __table_args__ = (
+        Index("ix_feedback_query_hash", "query_hash", "is_helpful"),
+        Index("ix_feedback_is_helpful", "is_helpful"),
+    )
+
+def _migrate():
+    """Adds columns introduced after the table was first created and backfills query_hash."""
+    columns = {c["name"] for c in inspect(engine).get_columns("feedback")}
+    with engine.begin() as conn:
+        if "query_hash" not in columns:
+            conn.execute(text("ALTER TABLE feedback ADD COLUMN query_hash VARCHAR(64)"))
+            rows = conn.execute(text('SELECT id, "query" FROM feedback')).fetchall()
+            if rows:
+                conn.execute(
+                    text("UPDATE feedback SET query_hash = :hash WHERE id = :id"),
+                    [{"hash": query_hash(q), "id": i} for i, q in rows],
+                )
+        if "created_at" not in columns:
+            conn.execute(text("ALTER TABLE feedback ADD COLUMN created_at FLOAT"))
 
 # Create table if not exists
 Base.metadata.create_all(bind=engine)
+_migrate()
+for index in Feedback.__table__.indexes:
+    index.create(bind=engine, checkfirst=True)
+
+class FeedbackRecorder:
+    """
+    Write-behind queue for feedback rows. Requests only append to memory;
+    a background thread writes queued rows in one bulk insert per batch,
+    every `interval` seconds or as soon as `batch_size` rows are waiting.
+    close() writes whatever is left.
+    """
+
+    def __init__(self, batch_size: int = FEEDBACK_BATCH_SIZE, interval: float = FEEDBACK_FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.interval = interval
+        self._pending = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._thread = None
+        self.stats_counter = {"queued": 0, "written": 0, "batches": 0, "errors": 0}
+
+    def _ensure_started(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="feedback-writer", daemon=True)
+            self._thread.start()
+
+    def add(self, row: dict):
+        with self._lock:
+            self._pending.append(row)
+            self.stats_counter["queued"] += 1
+            self._ensure_started()
+            if len(self._pending) >= self.batch_size:
+                self._wake.set()
+
+    def flush(self):
+        with self._lock:
+            rows, self._pending = self._pending, []
+        if not rows:
+            return
+        try:
+            with SessionLocal() as session:
+                session.execute(insert(Feedback), rows)
+                session.commit()
+            self.stats_counter["written"] += len(rows)
+            self.stats_counter["batches"] += 1
+        except Exception:
+            self.stats_counter["errors"] += 1
+            logger.exception("Writing %d feedback rows failed; re-queued", len(rows))
+            with self._lock:
+                self._pending[:0] = rows
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+    def close(self):
+        self._closed = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+        self.flush()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self.stats_counter, "pending": len(self._pending)}
+
+recorder = FeedbackRecorder()
 
 def add_feedback(query: str, answer: str, is_helpful: bool, sources: str):
-    session = SessionLocal()
-    fb = Feedback(query=query, answer=answer, is_helpful=is_helpful, sources=sources)
-    session.add(fb)
-    session.commit()
-    session.close()
-    return {"status": "recorded"}
\ No newline at end of file
+    recorder.add({
+        "query": query,
+        "answer": answer,
+        "is_helpful": is_helpful,
+        "sources": sources,
+        "query_hash": query_hash(query),
+        "created_at": time.time(),
+    })
+    return {"status": "recorded"}
+
+def shutdown():
+    recorder.close()
@@ -0,0 +1,61 @@
+import bisect
+import threading
+from backend import manifest
+
+class FilterIndex:
+    """
+    ID-set indexes over the document manifest: filename -> chunk ids,
+    tag -> filenames, and filenames sorted by upload time. Rebuilt only
+    when the manifest changes, so resolving a filter costs set operations
+    on the matching documents, never a scan of the corpus.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self.chunks = {}          # filename -> frozenset of chunk ids
+        self.by_tag = {}          # tag -> set of filenames
+        self._times = []          # sorted upload timestamps
+        self._timed_files = []    # filenames in the same order
+
+    def _refresh(self):
+        version = manifest.version()
+        if version == self._version:
+            return
+        documents = manifest.list_documents()
+        chunks, by_tag = {}, {}
+        for name, entry in documents.items():
+            chunks[name] = frozenset(entry["chunks"])
+            for tag in entry.get("tags", []):
+                by_tag.setdefault(tag, set()).add(name)
+        timed = sorted((entry.get("uploaded_at", 0.0), name) for name, entry in documents.items())
+        self.chunks, self.by_tag = chunks, by_tag
+        self._times = [t for t, _ in timed]
+        self._timed_files = [name for _, name in timed]
+        self._version = version
+
+    def resolve(self, filenames=None, tags=None, uploaded_after=None, uploaded_before=None):
+        """
+        Returns the set of chunk ids of documents matching every given
+        criterion (any of `filenames`, any of `tags`, upload time within
+        the bounds), or None when no criterion is given.
+        """
+        if not filenames and not tags and uploaded_after is None and uploaded_before is None:
+            return None
+        with self._lock:
+            self._refresh()
+            matched = None
+            if filenames:
+                matched = {name for name in filenames if name in self.chunks}
+            if tags:
+                tagged = set().union(*(self.by_tag.get(tag, ()) for tag in tags))
+                matched = tagged if matched is None else matched & tagged
+            if uploaded_after is not None or uploaded_before is not None:
+                lo = bisect.bisect_left(self._times, uploaded_after) if uploaded_after is not None else 0
+                hi = bisect.bisect_right(self._times, uploaded_before) if uploaded_before is not None \
+                    else len(self._times)
+                in_range = set(self._timed_files[lo:hi])
+                matched = in_range if matched is None else matched & in_range
+            return set().union(*(self.chunks[name] for name in matched))
+
+filter_index = FilterIndex()
@@ -0,0 +1,45 @@
+import numpy as np
+
+FUSION_METHODS = ("rrf", "score")
+RRF_K = 60   # standard reciprocal-rank constant; damps the head of each list
+
+def _key(hit: dict):
+    # Entries indexed before chunking have no chunk id
+    return hit.get("id") or hit["preview"]
+
+def _normalized(scores):
+    scores = np.asarray(scores, dtype=np.float64)
+    if not len(scores):
+        return scores
+    lo, hi = scores.min(), scores.max()
+    if hi == lo:
+        return np.ones_like(scores)
+    return (scores - lo) / (hi - lo)
+
+def fuse(dense_hits, sparse_hits, k: int, method: str = "rrf",
+         dense_weight: float = 1.0, sparse_weight: float = 1.0):
+    """
+    Combines two ranked hit lists (best first, each hit carrying "id" and
+    "score") into one list of at most k hits, joined on chunk id.
+
+    rrf:   sum of weight / (RRF_K + rank) over the lists a hit appears in
+    score: weighted sum of per-list min-max normalized scores
+    """
+    if method not in FUSION_METHODS:
+        raise ValueError(f"Unknown fusion method: {method}")
+
+    fused, hits = {}, {}
+    for ranked, weight in ((dense_hits, dense_weight), (sparse_hits, sparse_weight)):
+        if not ranked or weight == 0:
+            continue
+        if method == "rrf":
+            contributions = weight / (RRF_K + np.arange(1, len(ranked) + 1))
+        else:
+            contributions = weight * _normalized([h["score"] for h in ranked])
+        for hit, contribution in zip(ranked, contributions):
+            key = _key(hit)
+            fused[key] = fused.get(key, 0.0) + float(contribution)
+            hits.setdefault(key, hit)
+
+    best = sorted(fused, key=fused.get, reverse=True)[:k]
+    return [{**hits[key], "score": fused[key]} for key in best]
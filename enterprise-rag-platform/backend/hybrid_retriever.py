@@ -1,80 +1,343 @@
-from rank_bm25 import BM25Okapi
-from langchain_openai import OpenAIEmbeddings
-from langchain.vectorstores import Chroma
-from langchain.chains import RetrievalQA
-from langchain_openai import ChatOpenAI
-import chromadb
+import json
+import os
+import logging
+import threading
+from backend.resources import get_llm, get_vector_store
+from backend.sparse_index import SparseIndex, FORMAT, VOCAB_FILE
+from backend.tokenizer import STEMMER_VERSION, Tokenizer
+from backend.fusion import fuse
+from backend.answer_cache import answer_cache, scope_key
+from backend.filters import filter_index
+from backend.context import build_context, chunk_texts
+from backend.tracing import llm_config, span, traced
 
-client = chromadb.Client()
-collection = client.get_or_create_collection("docs")
+logger = logging.getLogger(__name__)
 
-# Build BM25 index
-bm25_corpus = []   # list of tokenized chunks
-bm25_lookup = []   # mapping back to docs
+# Sparse index, persisted under SPARSE_INDEX_DIR so it survives restarts
+SPARSE_INDEX_DIR = os.getenv("SPARSE_INDEX_DIR", "sparse_index")
+LOOKUP_FILE = "lookup.jsonl"   # default name; compaction writes a new one and records it in the manifest
+# Rebuild the index once this fraction of its documents is tombstoned
+COMPACTION_THRESHOLD = float(os.getenv("COMPACTION_THRESHOLD", "0.2"))
+PREVIEW_CHARS = 200   # chunk text kept per hit; the lookup stores no more than this
+
+# Replaced on load by the settings the saved index was built with
+_tokenizer = Tokenizer()
+
+def tokenize(text: str):
+    return _tokenizer(text)
+
+def _lookup_row(doc) -> dict:
+    return {"id": doc.get("id"), "filename": doc["filename"], "page": doc.get("page"),
+            "preview": doc["text"][:PREVIEW_CHARS]}
+
+def _lookup_path(index) -> str:
+    return os.path.join(SPARSE_INDEX_DIR, index.meta.get("lookup", LOOKUP_FILE))
 
 def build_bm25_index(docs):
-    global bm25_corpus, bm25_lookup
-    bm25_corpus = [doc["text"].split() for doc in docs]
-    bm25_lookup = docs
-    return BM25Okapi(bm25_corpus)
-
-bm25 = None
-
-def ingest_for_bm25(text_chunks, filename):
-    global bm25, bm25_lookup
-    new_docs = [{"filename": filename, "text": chunk} for chunk in text_chunks]
-    if bm25 is None:
-        bm25 = build_bm25_index(new_docs)
-    else:
-        bm25_corpus.extend([doc["text"].split() for doc in new_docs])
-        bm25_lookup.extend(new_docs)
-        bm25 = BM25Okapi(bm25_corpus)
-
-def query_hybrid(question: str, k: int = 3):
-    if bm25 is None:
-        raise ValueError("BM25 index not initialized. Call ingest_for_bm25 first.")
-
-    # Dense retriever
-    embeddings = OpenAIEmbeddings(model="text-embedding-3-large")
-    vectordb = Chroma(client=client, collection_name="docs", embedding_function=embeddings)
-    dense_results = vectordb.similarity_search(question, k=k)
+    global bm25_lookup
+    index = SparseIndex(path=SPARSE_INDEX_DIR)
+    index.meta["tokenizer"] = _tokenizer.config
+    for doc in docs:
+        index.add_document(tokenize(doc["text"]))
+    bm25_lookup = [_lookup_row(doc) for doc in docs]
+    return index
+
+def load_bm25_index():
+    """
+    Memory-maps the saved sparse index and reads its doc lookup.
+    Returns (None, []) when nothing has been ingested yet.
+    """
+    global _tokenizer
+    manifest = SparseIndex.read_manifest(SPARSE_INDEX_DIR)
+    if manifest is None:
+        # Files of a first flush that never reached the manifest
+        for name in (LOOKUP_FILE, VOCAB_FILE):
+            if os.path.exists(os.path.join(SPARSE_INDEX_DIR, name)):
+                os.remove(os.path.join(SPARSE_INDEX_DIR, name))
+        return None, []
+    if manifest.get("format", 1) != FORMAT:
+        return _migrate_bm25_index(manifest)
+    settings = manifest.get("meta", {}).get("tokenizer", {})
+    recorded = Tokenizer.from_config(settings)
+    if recorded.config != _tokenizer.config:
+        logger.warning("Sparse index was built with tokenizer settings %s; ignoring %s",
+                       settings, _tokenizer.config)
+    _tokenizer = recorded
+    if settings.get("stemming") and settings.get("stemmer", 1) != STEMMER_VERSION:
+        # Its terms were stemmed differently from the queries stem() produces now
+        logger.info("Sparse index was stemmed by stemmer version %s; rebuilding",
+                    settings.get("stemmer", 1))
+        return _migrate_bm25_index(manifest)
+    index = SparseIndex.load(SPARSE_INDEX_DIR)
+    lookup = []
+    with open(_lookup_path(index)) as f:
+        for line in f:
+            lookup.append(json.loads(line))
+    if len(lookup) > len(index):
+        # Lookup rows written by a flush that never reached the manifest
+        lookup = lookup[:len(index)]
+        _write_lookup(index, lookup, mode="w")
+    return index, lookup
+
+def _migrate_bm25_index(manifest):
+    """
+    Rebuilds an index saved in an older format, or stemmed by an older
+    stemmer, with the current tokenizer. Format-1 lookups hold the chunk
+    text; later ones only a preview, so the text comes from the vector
+    store by chunk id.
+    Tombstoned chunks are dropped on the way; the old segments and lookup
+    are removed once the new manifest is written.
+    """
+    old_lookup = os.path.join(SPARSE_INDEX_DIR, manifest.get("meta", {}).get("lookup", LOOKUP_FILE))
+    deleted = set(manifest.get("deleted", []))
+    docs = []
+    with open(old_lookup) as f:
+        for i, line in enumerate(f):
+            if i >= manifest["num_docs"]:
+                break
+            if i not in deleted:
+                docs.append(json.loads(line))
+    texts = chunk_texts([doc.get("id") for doc in docs if "text" not in doc])
+    for doc in docs:
+        if "text" not in doc:
+            if doc.get("id") not in texts:
+                logger.warning("Chunk %s of %s is not in the vector store; indexing its preview only",
+                               doc.get("id"), doc["filename"])
+            doc["text"] = texts.get(doc.get("id"), doc.get("preview", ""))
+    vocab_path = os.path.join(SPARSE_INDEX_DIR, VOCAB_FILE)
+    if os.path.exists(vocab_path):
+        # Left by an earlier migration that didn't finish
+        os.remove(vocab_path)
+
+    index = SparseIndex(path=SPARSE_INDEX_DIR)
+    index._next_segment = manifest["next_segment"]
+    index._obsolete = [os.path.join(SPARSE_INDEX_DIR, name) for name in manifest["segments"]]
+    index.meta = {**manifest.get("meta", {}), "tokenizer": _tokenizer.config,
+                  "lookup": f"lookup-{manifest['next_segment']:06d}.jsonl"}
+    for doc in docs:
+        index.add_document(tokenize(doc["text"]))
+    lookup = [_lookup_row(doc) for doc in docs]
+    _write_lookup(index, lookup, mode="w")
+    index._dirty = True   # write the manifest even if every chunk was tombstoned
+    index.flush()
+    os.remove(old_lookup)
+    logger.info("Rebuilt sparse index in format %d: %d chunks", FORMAT, len(lookup))
+    return index, lookup
+
+def _write_lookup(index, docs, mode="a"):
+    os.makedirs(SPARSE_INDEX_DIR, exist_ok=True)
+    with open(_lookup_path(index), mode) as f:
+        for doc in docs:
+            f.write(json.dumps(doc) + "\n")
+
+def _live_chunk_docs():
+    # chunk id -> sparse doc id, for chunks that aren't tombstoned
+    deleted = bm25.deleted if bm25 is not None else ()
+    return {doc["id"]: i for i, doc in enumerate(bm25_lookup) if doc.get("id") and i not in deleted}
+
+# Loaded on first use (or at app startup), never on import: batch-ingest
+# worker processes must not open, trim or migrate the live index
+bm25, bm25_lookup = None, []   # bm25_lookup maps sparse doc id back to docs
+bm25_chunks = {}
+# Readers take (index, lookup, chunk map) from this one reference, so a
+# compaction swapping all three never shows them a mismatched set; None
+# until loaded
+_sparse = None
+# Serializes writers (single uploads and batch jobs); queries don't take it,
+# SparseIndex.score works on a snapshot of the index instead
+_bm25_lock = threading.Lock()
+
+def load_sparse():
+    """Loads the saved sparse index once; returns the (index, lookup, chunk map) snapshot."""
+    global bm25, bm25_lookup, bm25_chunks, _sparse
+    sparse = _sparse
+    if sparse is not None:
+        return sparse
+    with _bm25_lock:
+        if _sparse is None:
+            bm25, bm25_lookup = load_bm25_index()
+            bm25_chunks = _live_chunk_docs()
+            _sparse = (bm25, bm25_lookup, bm25_chunks)
+        return _sparse
+_compacting = threading.Event()
+
+def add_docs_to_bm25(new_docs):
+    """
+    Adds chunk docs ({"id", "filename", "page", "text"}) and persists them
+    with a single flush. Chunks that are already indexed are skipped.
+    """
+    global bm25, _sparse
+    load_sparse()
+    with _bm25_lock:
+        new_docs = [doc for doc in new_docs if doc.get("id") not in bm25_chunks]
+        if not new_docs:
+            return
+        start = len(bm25_lookup)
+        rows = [_lookup_row(doc) for doc in new_docs]
+        if bm25 is None:
+            bm25 = build_bm25_index(new_docs)
+            _sparse = (bm25, bm25_lookup, bm25_chunks)
+        else:
+            # Lookup first: a concurrent query must never see a doc id it can't
+            # resolve; each add_document is published to queries atomically
+            bm25_lookup.extend(rows)
+            # Only the new chunks' postings are touched
+            for doc in new_docs:
+                bm25.add_document(tokenize(doc["text"]))
+        bm25_chunks.update((doc["id"], start + i) for i, doc in enumerate(new_docs) if doc.get("id"))
+        # Lookup rows go first; the index manifest update commits them
+        _write_lookup(bm25, rows)
+        bm25.flush()
+
+def remove_docs_from_bm25(chunk_ids):
+    """
+    Tombstones the given chunks; they stop matching immediately. Starts a
+    background compaction once enough of the index is tombstoned.
+    """
+    load_sparse()
+    with _bm25_lock:
+        if bm25 is None:
+            return
+        for cid in chunk_ids:
+            doc = bm25_chunks.pop(cid, None)
+            if doc is not None:
+                bm25.delete_document(doc)
+        bm25.flush()
+        if len(bm25.deleted) >= COMPACTION_THRESHOLD * len(bm25):
+            schedule_compaction()
+
+def schedule_compaction() -> bool:
+    """Runs compact_bm25 in a background thread unless one is running."""
+    if _compacting.is_set():
+        return False
+    _compacting.set()
+    threading.Thread(target=compact_bm25, name="bm25-compaction", daemon=True).start()
+    return True
+
+def compact_bm25():
+    """
+    Rebuilds the sparse index and its lookup without tombstoned chunks.
+    Queries keep reading the old memory-mapped segments until the new
+    index is swapped in; ingestion waits for the rebuild.
+    """
+    global bm25, bm25_lookup, bm25_chunks, _sparse
+    _compacting.set()
+    try:
+        load_sparse()
+        with _bm25_lock:
+            if bm25 is None or not bm25.deleted:
+                return
+            bm25.flush()
+            index, remap = bm25.compacted()
+            lookup = [doc for i, doc in enumerate(bm25_lookup) if remap[i] >= 0]
+            old_lookup = _lookup_path(bm25)
+            index.meta["lookup"] = f"lookup-{index._next_segment - 1:06d}.jsonl"
+            _write_lookup(index, lookup, mode="w")
+            # The manifest now points at the new segments and lookup
+            index.flush()
+            os.remove(old_lookup)
+            removed = len(bm25) - len(index)
+            bm25, bm25_lookup = index, lookup
+            bm25_chunks = _live_chunk_docs()
+            _sparse = (bm25, bm25_lookup, bm25_chunks)
+        logger.info("bm25 compaction dropped %d tombstoned chunks, %d remain", removed, len(index))
+    except Exception:
+        logger.exception("bm25 compaction failed")
+    finally:
+        _compacting.clear()
+
+def sparse_stats() -> dict:
+    index = load_sparse()[0]
+    if index is None:
+        return {"docs": 0, "deleted": 0, "segments": 0, "compacting": _compacting.is_set()}
+    return {
+        "docs": len(index),
+        "deleted": len(index.deleted),
+        "segments": len(index.segments),
+        "compacting": _compacting.is_set(),
+    }
+
+# Each retriever contributes this many candidates per requested hit
+CANDIDATE_MULTIPLIER = int(os.getenv("FUSION_CANDIDATE_MULTIPLIER", "4"))
+
+def retrieve_hybrid(question: str, k: int = 3, fusion: str = "rrf",
+                    dense_weight: float = 1.0, sparse_weight: float = 1.0, filters: dict = None):
+    """
+    Dense + sparse retrieval without the answer step.
+    Returns the top k fused sources (see backend.fusion.fuse).
+
+    `filters` (filenames, tags, uploaded_after, uploaded_before; see
+    FilterIndex.resolve) restricts both retrievers to the matching chunks
+    before they rank anything.
+    """
+    index, lookup, chunk_docs = load_sparse()
+    if index is None:
+        raise ValueError("BM25 index not initialized. Ingest a document first.")
+    candidates = k * CANDIDATE_MULTIPLIER
+
+    with span("filters"):
+        allowed = filter_index.resolve(**filters) if filters else None
+    if allowed is not None and not allowed:
+        return []
+
+    # Dense retriever (Chroma returns distances: smaller is closer)
+    dense_hits = []
+    if dense_weight:
+        with span("dense_search"):
+            vectordb = get_vector_store()
+            where = {"chunk_id": {"$in": sorted(allowed)}} if allowed is not None else None
+            for doc, distance in vectordb.similarity_search_with_score(question, k=candidates, filter=where):
+                dense_hits.append({
+                    "id": doc.metadata.get("chunk_id"),
+                    "filename": doc.metadata.get("filename", "unknown"),
+                    "page": doc.metadata.get("page"),
+                    "preview": doc.page_content[:PREVIEW_CHARS],
+                    "score": -float(distance),
+                })
 
     # Sparse retriever
-    bm25_scores = bm25.get_scores(question.split())
-    top_sparse = sorted(
-        zip(bm25_scores, bm25_lookup),
-        key=lambda x: x[0],
-        reverse=True
-    )[:k]
-
-    # Fusion
-    combined = []
-    for doc in dense_results:
-        combined.append({
-            "filename": doc.metadata.get("filename", "unknown"),
-            "preview": doc.page_content[:200],
-            "score": 1.0
-        })
-    for score, doc in top_sparse:
-        combined.append({
-            "filename": doc["filename"],
-            "preview": doc["text"][:200],
-            "score": float(score)
-        })
-
-    # Deduplicate
-    seen = set()
-    deduped = []
-    for doc in combined:
-        if doc["preview"] not in seen:
-            deduped.append(doc)
-            seen.add(doc["preview"])
-
-    # Answer with LLM
-    retriever_docs = [d["preview"] for d in deduped[:k]]
-    context = "\n\n".join(retriever_docs)
-    llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
-    prompt = f"Answer the following using the context below:\n\nContext:\n{context}\n\nQuestion: {question}\nAnswer:"
-    answer = llm.invoke(prompt).content
-
-    return answer, deduped[:k]
\ No newline at end of file
+    sparse_hits = []
+    if sparse_weight:
+        with span("sparse_search"):
+            allowed_docs = None
+            if allowed is not None:
+                allowed_docs = [doc for doc in map(chunk_docs.get, allowed) if doc is not None]
+            for doc_id, score in index.top_k(tokenize(question), candidates, allowed_docs):
+                doc = lookup[doc_id]
+                sparse_hits.append({
+                    "id": doc.get("id"),
+                    "filename": doc["filename"],
+                    "page": doc.get("page"),
+                    "preview": doc["preview"],
+                    "score": score,
+                })
+
+    with span("fusion"):
+        return fuse(dense_hits, sparse_hits, k=k, method=fusion,
+                    dense_weight=dense_weight, sparse_weight=sparse_weight)
+
+def query_hybrid(question: str, k: int = 3, **retrieval_options):
+    with traced("query_hybrid"):
+        # Near-duplicate questions replay an earlier answer
+        if answer_cache.enabled:
+            with span("answer_cache"):
+                version = answer_cache.version
+                scope = scope_key(endpoint="query_hybrid", k=k, **retrieval_options)
+                vector = answer_cache.embed(question)
+                cached = answer_cache.lookup(vector, scope)
+            if cached is not None:
+                return cached["answer"], cached["sources"]
+
+        sources = retrieve_hybrid(question, k=k, **retrieval_options)
+
+        # Answer with LLM over the packed chunk text
+        # Cite only the chunks that made it into the prompt
+        with span("context"):
+            context, sources = build_context(sources)
+        llm = get_llm()
+        prompt = f"Answer the following using the context below:\n\nContext:\n{context}\n\nQuestion: {question}\nAnswer:"
+        answer = llm.invoke(prompt, config=llm_config()).content
+
+        if answer_cache.enabled:
+            answer_cache.store(vector, scope, version, answer, sources)
+        return answer, sources
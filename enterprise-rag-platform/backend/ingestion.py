@@ -1,65 +1,180 @@
-import io
-from langchain_openai import OpenAIEmbeddings
-from langchain_community.vectorstores import Chroma
-from docx import Document
-import pdfplumber
-from backend.hybrid_retriever import ingest_for_bm25  # <-- import your BM25 ingestion function
+import os
+import threading
+from contextlib import ExitStack
+from backend.hybrid_retriever import add_docs_to_bm25, remove_docs_from_bm25  # <-- import your BM25 ingestion function
+from backend.resources import get_vector_store
+from backend.answer_cache import answer_cache
+from backend.manifest import file_hash, get_document, put_document, remove_document, set_tags
+from backend.preparation import iter_document_chunks
 
-# This is your vector store directory
-VECTOR_STORE_DIR = "vector_store"
+# Chunks are embedded and written in groups of this size while the file is
+# still being read, so a large document never sits in memory as a whole.
+INDEX_BATCH_CHUNKS = int(os.getenv("INDEX_BATCH_CHUNKS", "256"))
 
-# ---------- Text extraction helpers ----------
-def extract_text_from_pdf(file_bytes: bytes) -> str:
-    text = ""
-    with pdfplumber.open(io.BytesIO(file_bytes)) as pdf:
-        for page in pdf.pages:
-            page_text = page.extract_text()
-            if page_text:
-                text += page_text + "\n"
-    return text.strip()
+# ---------- Document manifest ----------
+_file_locks = {}
+_file_locks_lock = threading.Lock()
 
-def extract_text_from_docx(file_bytes: bytes) -> str:
-    text = ""
-    doc = Document(io.BytesIO(file_bytes))
-    for para in doc.paragraphs:
-        text += para.text + "\n"
-    return text.strip()
+def _file_lock(filename: str) -> threading.Lock:
+    # Re-ingesting the same file concurrently would race on its manifest entry
+    with _file_locks_lock:
+        return _file_locks.setdefault(filename, threading.Lock())
 
-def extract_text_from_txt(file_bytes: bytes) -> str:
-    return file_bytes.decode(errors="ignore").strip()
+def delete_chunks(chunk_ids):
+    """Removes chunks from the vector store and tombstones them in BM25."""
+    chunk_ids = list(chunk_ids)
+    if not chunk_ids:
+        return
+    vectorstore = get_vector_store()
+    vectorstore.delete(ids=chunk_ids)
+    vectorstore.persist()
+    remove_docs_from_bm25(chunk_ids)
+    answer_cache.invalidate()
+
+def delete_document(filename: str):
+    """
+    Removes every chunk of a file from both stores. Returns the number of
+    chunks removed, or None if the file was never ingested.
+    """
+    with _file_lock(filename):
+        previous = get_document(filename)
+        if previous is None:
+            return None
+        delete_chunks(previous["chunks"])
+        remove_document(filename)
+    return len(previous["chunks"])
 
-def extract_preview(file_bytes: bytes, filename: str) -> str:
-    filename = filename.lower()
-    if filename.endswith(".pdf"):
-        return extract_text_from_pdf(file_bytes)[:300]
-    elif filename.endswith(".docx"):
-        return extract_text_from_docx(file_bytes)[:300]
-    elif filename.endswith(".txt"):
-        return extract_text_from_txt(file_bytes)[:300]
-    else:
-        return "Preview not available"
+def _replace_document(filename: str, digest: str, chunk_ids, pages: int, preview: str, previous, tags=None) -> int:
+    """
+    Drops the previous version's chunks that the new version no longer has
+    and records the new version. Returns the number of chunks removed.
+    """
+    removed = set(previous["chunks"]) - set(chunk_ids) if previous else set()
+    delete_chunks(removed)
+    put_document(filename, digest, chunk_ids, pages, preview, tags)
+    # New tags and upload time change what filters match, even when no
+    # chunk was added or removed
+    answer_cache.invalidate()
+    return len(removed)
 
 # ---------- Main ingestion ----------
-def ingest_document(file_bytes: bytes, filename: str):
-    text = ""
-    filename_lower = filename.lower()
-    if filename_lower.endswith(".pdf"):
-        text = extract_text_from_pdf(file_bytes)
-    elif filename_lower.endswith(".docx"):
-        text = extract_text_from_docx(file_bytes)
-    elif filename_lower.endswith(".txt"):
-        text = extract_text_from_txt(file_bytes)
-    else:
-        raise ValueError(f"Unsupported file type: {filename}")
+def index_chunks(chunks):
+    """
+    Writes chunks to the vector store and the BM25 index in one go. Chroma
+    embeds all chunks of the call through a single batched embed_documents
+    request; both stores key the chunks by the same chunk id.
+    """
+    if not chunks:
+        return
 
     # --- Add to Chroma vector store ---
-    embeddings = OpenAIEmbeddings(model="text-embedding-3-large")
-    vectorstore = Chroma(persist_directory=VECTOR_STORE_DIR, embedding_function=embeddings)
-    vectorstore.add_texts([text], metadatas=[{"filename": filename, "preview": extract_preview(file_bytes, filename)}])
+    vectorstore = get_vector_store()
+    vectorstore.add_texts(
+        [c["text"] for c in chunks],
+        metadatas=[{
+            "filename": c["filename"],
+            "chunk_id": c["id"],
+            "page": c["page"],
+            "offset": c["offset"],
+            "chunk_index": c["index"],
+            "preview": c["text"][:300],
+        } for c in chunks],
+        ids=[c["id"] for c in chunks],
+    )
     vectorstore.persist()
 
     # --- Add to BM25 index for sparse retrieval ---
-    # Split text into smaller chunks (optional, improves BM25 granularity)
-    chunk_size = 500
-    text_chunks = [text[i:i+chunk_size] for i in range(0, len(text), chunk_size)]
-    ingest_for_bm25(text_chunks, filename)
\ No newline at end of file
+    add_docs_to_bm25([
+        {"id": c["id"], "filename": c["filename"], "page": c["page"], "text": c["text"]}
+        for c in chunks
+    ])
+
+    # Answers cached before this write may now be stale
+    answer_cache.invalidate()
+
+def _tags_for(previous, tags):
+    # No tags given keeps the ones the document already has
+    if tags is None:
+        return previous.get("tags", []) if previous else []
+    return tags
+
+def index_documents(docs, tags=None):
+    """
+    Indexes prepared documents ({"filename", "hash", "preview", "pages",
+    "chunks"}). Unchanged files are skipped and changed files only have
+    their new chunks embedded. When a filename repeats, the last one wins.
+    `tags` applies to every document.
+    """
+    docs = list({d["filename"]: d for d in docs}.values())
+    with ExitStack() as stack:
+        for name in sorted(d["filename"] for d in docs):
+            stack.enter_context(_file_lock(name))
+        plans = []
+        for d in docs:
+            previous = get_document(d["filename"])
+            if previous and previous["hash"] == d["hash"]:
+                if tags is not None and set_tags(d["filename"], tags):
+                    # Tag filters now match differently
+                    answer_cache.invalidate()
+                continue
+            known = set(previous["chunks"]) if previous else set()
+            plans.append((d, previous, [c for c in d["chunks"] if c["id"] not in known]))
+        new = [c for _, _, chunks in plans for c in chunks]
+        try:
+            index_chunks(new)
+        except BaseException:
+            # None of these chunks has a manifest entry yet; take out the
+            # ones that were written before the failure
+            delete_chunks(c["id"] for c in new)
+            raise
+        for d, previous, _ in plans:
+            _replace_document(d["filename"], d["hash"], [c["id"] for c in d["chunks"]],
+                              d["pages"], d["preview"], previous, _tags_for(previous, tags))
+
+def ingest_document(source, filename: str, tags=None, digest: str = None) -> dict:
+    """
+    Ingests one file from bytes, a path or a binary file object. The file
+    is parsed once; chunks are indexed in batches as pages are read.
+
+    A file whose content hash matches the manifest is not parsed at all.
+    For a changed file only chunks the previous version didn't have are
+    embedded, and chunks it no longer has are removed from both stores.
+    `tags` replaces the document's tags; None keeps them. `digest` is the
+    file's sha256 when the caller already has it (uploads are hashed while
+    they stream in).
+    """
+    digest = digest or file_hash(source)
+    with _file_lock(filename):
+        previous = get_document(filename)
+        if previous and previous["hash"] == digest:
+            if tags is not None and set_tags(filename, tags):
+                # Tag filters now match differently
+                answer_cache.invalidate()
+            return {"filename": filename, "preview": previous["preview"], "pages": previous["pages"],
+                    "chunks": len(previous["chunks"]), "added": 0, "removed": 0, "unchanged": True}
+
+        known = set(previous["chunks"]) if previous else set()
+        tap, chunks = iter_document_chunks(source, filename)
+        batch, ids, indexed = [], [], []
+        try:
+            for chunk in chunks:
+                ids.append(chunk["id"])
+                if chunk["id"] in known:
+                    continue
+                batch.append(chunk)
+                if len(batch) >= INDEX_BATCH_CHUNKS:
+                    indexed.extend(c["id"] for c in batch)
+                    index_chunks(batch)
+                    batch = []
+            indexed.extend(c["id"] for c in batch)
+            index_chunks(batch)
+        except BaseException:
+            # Chunks indexed before the failure have no manifest entry yet, so
+            # nothing could ever delete them; take them out again
+            delete_chunks(indexed)
+            raise
+        added = len(indexed)
+        removed = _replace_document(filename, digest, ids, tap.pages, tap.preview, previous,
+                                    _tags_for(previous, tags))
+    return {"filename": filename, "preview": tap.preview, "pages": tap.pages,
+            "chunks": len(ids), "added": added, "removed": removed, "unchanged": False}
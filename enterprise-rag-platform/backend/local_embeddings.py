@@ -0,0 +1,102 @@
+import os
+import re
+import hashlib
+import threading
+from typing import List
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+HASHING_EMBEDDING_DIM = int(os.getenv("HASHING_EMBEDDING_DIM", "1024"))
+HASHING_NGRAMS = int(os.getenv("HASHING_NGRAMS", "2"))          # 1: words only, 2: words and word pairs
+HASHING_BATCH_ROWS = 4096                                       # texts turned into one matrix at a time
+HASHING_MAX_TERMS = 1_000_000                                   # term -> bucket memo is cleared past this
+
+_TERM = re.compile(r"\w+")
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Local, stateless embeddings by feature hashing. Every lowercased word
+    (and word pair, with ngrams=2) is hashed to a signed bucket of a
+    `dim`-sized vector; counts are damped with log1p and the vector is
+    L2-normalized, so cosine similarity rewards shared vocabulary.
+
+    A batch is embedded at once: each distinct term is hashed once and all
+    counts are accumulated with a single bincount. Nothing is fitted, so
+    vectors are identical across processes and never need a network call.
+    """
+
+    def __init__(self, dim: int = HASHING_EMBEDDING_DIM, ngrams: int = HASHING_NGRAMS):
+        self.dim = dim
+        self.ngrams = ngrams
+        self.model = f"hashing-{dim}-{ngrams}"
+        self._buckets = {}   # term -> signed bucket, +/-(index + 1)
+        self._lock = threading.Lock()
+        self.stats_counter = {"texts": 0, "batches": 0}
+
+    def _bucket(self, term: str) -> int:
+        # blake2b rather than hash(): Python salts str hashes per process
+        h = int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+        bucket = h % self.dim + 1
+        return bucket if h >> 63 else -bucket
+
+    def _terms(self, text: str) -> List[str]:
+        words = _TERM.findall(text.lower())
+        terms = list(words)
+        for n in range(2, self.ngrams + 1):
+            terms.extend(" ".join(words[i:i + n]) for i in range(len(words) - n + 1))
+        return terms
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        codes, lengths, vocabulary = [], [], {}
+        for text in texts:
+            terms = self._terms(text)
+            codes.extend(vocabulary.setdefault(t, len(vocabulary)) for t in terms)
+            lengths.append(len(terms))
+
+        with self._lock:
+            if len(self._buckets) > HASHING_MAX_TERMS:
+                self._buckets.clear()
+            buckets = self._buckets
+            signed = np.fromiter(
+                (buckets[t] if t in buckets else buckets.setdefault(t, self._bucket(t)) for t in vocabulary),
+                dtype=np.int64, count=len(vocabulary),
+            )
+
+        signed = signed[np.asarray(codes, dtype=np.int64)]
+        rows = np.repeat(np.arange(len(texts)), lengths)
+        counts = np.bincount(
+            rows * self.dim + np.abs(signed) - 1,
+            weights=np.sign(signed),
+            minlength=len(texts) * self.dim,
+        ).reshape(len(texts), self.dim)
+        vectors = (np.sign(counts) * np.log1p(np.abs(counts))).astype(np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    def embed_matrix(self, texts: List[str]) -> np.ndarray:
+        """Returns a (len(texts), dim) float32 array of unit vectors."""
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        parts = [self._embed_batch(texts[i:i + HASHING_BATCH_ROWS])
+                 for i in range(0, len(texts), HASHING_BATCH_ROWS)]
+        with self._lock:
+            self.stats_counter["texts"] += len(texts)
+            self.stats_counter["batches"] += len(parts)
+        return parts[0] if len(parts) == 1 else np.vstack(parts)
+
+    # ---------- Embeddings interface ----------
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_matrix(list(texts)).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_matrix([text])[0].tolist()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self.stats_counter,
+                "model": self.model,
+                "dim": self.dim,
+                "memoized_terms": len(self._buckets),
+            }
@@ -1,15 +1,27 @@
 # backend/main.py
-from fastapi import FastAPI, UploadFile, Request
-from fastapi.responses import StreamingResponse
-from backend.ingestion import ingest_document
+from contextlib import asynccontextmanager
+import shutil
+import tempfile
+from fastapi import FastAPI, Request, BackgroundTasks, HTTPException
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from backend.ingestion import ingest_document, delete_document
 from backend.retriever import query_docs
-from backend.hybrid_retriever import query_hybrid
+from backend.hybrid_retriever import load_sparse, query_hybrid, schedule_compaction, sparse_stats
 from backend.streaming import stream_sse_with_memory
-from backend.models import IngestResponse, QueryRequest, QueryResponse, FeedbackRequest
-from backend.feedback import add_feedback
+from backend.models import IngestResponse, QueryRequest, StreamQueryRequest, QueryResponse, FeedbackRequest, BatchIngestResponse, IngestJobStatus
+from backend.feedback import add_feedback, recorder as feedback_recorder
+from backend import feedback as feedback_store
 from backend.streaming import stream_sse_with_memory
-from backend.mem import router as mem_router, format_sources_for_frontend
-from pydantic import BaseModel
+from backend.mem import router as mem_router, format_sources_for_frontend, memory_store
+from backend import resources, batch_ingest, concurrency, manifest
+from backend.concurrency import ingest_limiter, query_limiter
+from backend.answer_cache import answer_cache
+from backend.context import context_stats
+from backend.uploads import parse_tags, receive_form
+from backend.tracing import TracingMiddleware, render_metrics
+from pydantic import BaseModel, ValidationError
 import json
 from dotenv import load_dotenv
 import os
@@ -20,31 +32,196 @@ load_dotenv()
 # Now you can access OPENAI_API_KEY
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Build embeddings / vector stores / LLM clients once, before traffic
+    await run_in_threadpool(resources.warm_up)
+    await run_in_threadpool(load_sparse)
+    yield
+    batch_ingest.shutdown()
+    await run_in_threadpool(feedback_store.shutdown)
+    await resources.close()
+
+app = FastAPI(lifespan=lifespan)
 app.include_router(mem_router)
+# Per-stage spans, token counts and TTFT; a Server-Timing header on every traced response
+app.add_middleware(TracingMiddleware, paths={
+    "/query/": "query_docs",
+    "/query_hybrid/": "query_hybrid",
+    "/query_sse_memory/": "stream_sse_with_memory",
+})
 
 @app.get("/")
 def read_root():
     return {"message": "Hello World"}
 
-@app.post("/ingest/", response_model=IngestResponse)
-async def ingest(file: UploadFile):
-    content = await file.read()
-    ingest_document(content, file.filename)
-    return {"status": "success", "file": file.filename}
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Request, stage, TTFT and token metrics in the Prometheus text format."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/stats/resources")
+def resource_stats():
+    return resources.pool_stats()
+
+@app.get("/stats/embedding_cache")
+def embedding_cache_stats():
+    return resources.get_embeddings().stats()
+
+@app.get("/stats/concurrency")
+def concurrency_stats():
+    return concurrency.stats()
+
+@app.get("/stats/answer_cache")
+def answer_cache_stats():
+    return answer_cache.stats()
+
+@app.get("/stats/feedback")
+def feedback_stats():
+    return feedback_recorder.stats()
+
+@app.get("/stats/memory")
+def memory_stats():
+    return memory_store.stats()
+
+@app.get("/stats/vector_store")
+def vector_store_stats():
+    store = resources.get_vector_store()
+    return store.stats() if hasattr(store, "stats") else {"backend": resources.VECTOR_BACKEND}
+
+@app.get("/stats/sparse_index")
+def sparse_index_stats():
+    return sparse_stats()
+
+@app.get("/stats/context")
+def context_packing_stats():
+    return context_stats()
+
+# Uploads are parsed from the raw stream (backend.uploads), so the form is documented by hand
+def _upload_form(files: dict) -> dict:
+    properties = {**files, "tags": {"type": "string", "description": "Comma-separated tags"}}
+    return {"requestBody": {"required": True, "content": {"multipart/form-data": {
+        "schema": {"type": "object", "required": list(files), "properties": properties}}}}}
+
+INGEST_FORM = _upload_form({"file": {"type": "string", "format": "binary"}})
+BATCH_FORM = _upload_form({"files": {"type": "array", "items": {"type": "string", "format": "binary"}}})
+
+async def _ingest_upload(request: Request, filename: str = None):
+    """
+    Spools the "file" part to a temporary file while the body streams in
+    (refusing oversized uploads with 413) and ingests it from disk, page
+    by page. `filename` overrides the uploaded name.
+    """
+    async with ingest_limiter.slot():
+        workdir = tempfile.mkdtemp(prefix="upload-")
+        try:
+            uploads, fields = await receive_form(request, workdir)
+            upload = next((u for u in uploads if u.field == "file"), None)
+            if upload is None:
+                raise HTTPException(status_code=422, detail="Missing file field")
+            filename = filename or upload.filename
+            result = await run_in_threadpool(ingest_document, upload.path, filename,
+                                             parse_tags(fields.get("tags")), upload.digest)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        "status": "unchanged" if result["unchanged"] else "success",
+        "file": filename,
+        "chunks": result["chunks"],
+        "pages": result["pages"],
+        "preview": result["preview"],
+        "added": result["added"],
+        "removed": result["removed"],
+    }
+
+@app.post("/ingest/", response_model=IngestResponse, openapi_extra=INGEST_FORM)
+async def ingest(request: Request):
+    return await _ingest_upload(request)
+
+# ---------- Documents ----------
+@app.get("/documents/")
+def list_documents():
+    return [
+        {
+            "file": name,
+            "chunks": len(entry["chunks"]),
+            "pages": entry["pages"],
+            "hash": entry["hash"],
+            "tags": entry.get("tags", []),
+            "uploaded_at": entry.get("uploaded_at"),
+        }
+        for name, entry in manifest.list_documents().items()
+    ]
+
+@app.put("/documents/{filename:path}", response_model=IngestResponse, openapi_extra=INGEST_FORM)
+async def replace_document(filename: str, request: Request):
+    """Replaces a document with a new version; only changed chunks are re-embedded."""
+    return await _ingest_upload(request, filename)
+
+@app.delete("/documents/{filename:path}")
+async def remove_document(filename: str):
+    """
+    Deletes a document. Its chunks stop appearing in retrieval right away;
+    the sparse index is compacted in the background once enough of it is
+    tombstoned.
+    """
+    async with ingest_limiter.slot():
+        removed = await run_in_threadpool(delete_document, filename)
+    if removed is None:
+        raise HTTPException(status_code=404, detail="Unknown document")
+    return {"status": "deleted", "file": filename, "removed": removed}
+
+@app.post("/documents/compact")
+def compact_documents():
+    """Starts a sparse index compaction now instead of waiting for the threshold."""
+    return {"status": "started" if schedule_compaction() else "running"}
+
+@app.post("/ingest_batch/", response_model=BatchIngestResponse, openapi_extra=BATCH_FORM)
+async def ingest_batch(request: Request, background_tasks: BackgroundTasks):
+    """
+    Accepts many files and/or .zip archives. Returns immediately with a job
+    id; poll /ingest_batch/{job_id} for progress.
+    """
+    # The slot is held until the job finishes, bounding concurrent ingestion
+    await ingest_limiter.acquire()
+    try:
+        job_id = await batch_ingest.stage_uploads(request)
+    except BaseException:
+        ingest_limiter.release()
+        raise
+
+    async def run():
+        try:
+            await run_in_threadpool(batch_ingest.run_job, job_id)
+        finally:
+            ingest_limiter.release()
+
+    background_tasks.add_task(run)
+    job = batch_ingest.get_job(job_id)
+    return {"job_id": job_id, "status": job["status"], "total": job["total"]}
+
+@app.get("/ingest_batch/{job_id}", response_model=IngestJobStatus)
+def ingest_batch_status(job_id: str):
+    job = batch_ingest.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job id")
+    return job
 
 @app.post("/query/", response_model=QueryResponse)
 async def query(req: QueryRequest):
-    answer, sources = query_docs(req.query)
+    async with query_limiter.slot():
+        answer, sources = await run_in_threadpool(query_docs, req.query)
     return {"answer": answer, "sources": sources}
 
 @app.post("/query_hybrid/", response_model=QueryResponse)
 async def query_hybrid_endpoint(req: QueryRequest):
-    answer, sources = query_hybrid(req.query)
+    async with query_limiter.slot():
+        answer, sources = await run_in_threadpool(query_hybrid, req.query, k=req.k, **req.retrieval_options())
     return {"answer": answer, "sources": sources}
 
 @app.post("/feedback/")
 async def feedback(req: FeedbackRequest):
+    # Queued in memory; written in batches by the feedback writer thread
     result = add_feedback(
         query=req.query,
         answer=req.answer,
@@ -64,9 +241,43 @@ async def reset_memory(session_id: str):
 
 @app.post("/query_sse_memory/")
 async def query_sse_memory(request: Request):
-    data = await request.json()
-    question = data.get("question", "")
-    session_id = request.headers.get("X-Session-ID") or "default_session"
-    k = data.get("k", 3)
+    # Read by hand so the session can come from the X-Session-ID header
+    try:
+        body = StreamQueryRequest.model_validate(await request.json())
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False))
+    question = body.question or body.query or ""
+    session_id = request.headers.get("X-Session-ID") or body.session_id or "default_session"
+    k = body.k
+    retrieval_options = body.retrieval_options()
+
+    # The slot is held until the stream ends (or the client goes away)
+    await query_limiter.acquire()
+    try:
+        response = await stream_sse_with_memory(session_id=session_id, question=question, k=k,
+                                                request=request, **retrieval_options)
+    except BaseException:
+        query_limiter.release()
+        raise
+    # Released when the body finishes or is closed on disconnect; the
+    # background task covers a stream that never started
+    released = False
+
+    def release():
+        nonlocal released
+        if not released:
+            released = True
+            query_limiter.release()
+
+    body = response.body_iterator
+
+    async def guarded_body():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            release()
 
-    return stream_sse_with_memory(session_id=session_id, question=question, k=k)
\ No newline at end of file
+    response.body_iterator = guarded_body()
+    response.background = BackgroundTask(release)
+    return response
\ No newline at end of file
@@ -0,0 +1,88 @@
+import os
+import json
+import hashlib
+import time
+import threading
+
+# filename -> {"hash", "chunks", "pages", "preview", "tags", "uploaded_at"} for every ingested file
+DOCUMENT_MANIFEST = os.getenv("DOCUMENT_MANIFEST", "document_manifest.json")
+HASH_BLOCK_SIZE = 1024 * 1024
+
+_lock = threading.Lock()
+_documents = None
+_version = 0   # bumped on every change, so derived indexes know when to rebuild
+
+def _load():
+    global _documents
+    if _documents is None:
+        if os.path.exists(DOCUMENT_MANIFEST):
+            with open(DOCUMENT_MANIFEST) as f:
+                _documents = json.load(f)
+        else:
+            _documents = {}
+    return _documents
+
+def _save():
+    global _version
+    _version += 1
+    tmp = DOCUMENT_MANIFEST + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(_documents, f)
+    os.replace(tmp, DOCUMENT_MANIFEST)
+
+def file_hash(source) -> str:
+    """sha256 of bytes, a path or a seekable binary file object (rewound afterwards)."""
+    h = hashlib.sha256()
+    if isinstance(source, (bytes, bytearray)):
+        h.update(source)
+    elif isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            while block := f.read(HASH_BLOCK_SIZE):
+                h.update(block)
+    else:
+        pos = source.tell()
+        while block := source.read(HASH_BLOCK_SIZE):
+            h.update(block)
+        source.seek(pos)
+    return h.hexdigest()
+
+def get_document(filename: str):
+    with _lock:
+        entry = _load().get(filename)
+        return dict(entry) if entry else None
+
+def put_document(filename: str, file_hash: str, chunks, pages: int, preview: str, tags=None):
+    with _lock:
+        _load()[filename] = {
+            "hash": file_hash,
+            "chunks": list(chunks),
+            "pages": pages,
+            "preview": preview,
+            "tags": sorted(set(tags or [])),
+            "uploaded_at": time.time(),
+        }
+        _save()
+
+def set_tags(filename: str, tags) -> bool:
+    """Replaces a document's tags; returns whether anything changed."""
+    with _lock:
+        entry = _load().get(filename)
+        if entry is not None and entry.get("tags", []) != sorted(set(tags)):
+            entry["tags"] = sorted(set(tags))
+            _save()
+            return True
+        return False
+
+def remove_document(filename: str):
+    with _lock:
+        entry = _load().pop(filename, None)
+        if entry is not None:
+            _save()
+        return entry
+
+def version() -> int:
+    return _version
+
+def list_documents():
+    with _lock:
+        return {name: dict(entry) for name, entry in _load().items()}
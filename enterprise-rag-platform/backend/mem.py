@@ -1,27 +1,259 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import bisect
+import threading
+from collections import OrderedDict
 from fastapi import APIRouter
-from typing import Dict
+from backend.tokens import count_tokens
 
 router = APIRouter()
 
-# Simple in-memory store for demonstration
-memory_store: Dict[str, list] = {}  # session_id -> list of messages/sources
+MEMORY_MAX_SESSIONS = int(os.getenv("MEMORY_MAX_SESSIONS", "1000"))          # LRU bound on live sessions
+MEMORY_SESSION_TTL = float(os.getenv("MEMORY_SESSION_TTL", str(24 * 3600)))  # seconds idle before a session expires
+MEMORY_MAX_MESSAGES = int(os.getenv("MEMORY_MAX_MESSAGES", "40"))            # older messages are folded into the summary
+MEMORY_DB = os.getenv("MEMORY_DB", "")                                       # SQLite file; empty keeps sessions in memory only
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1500"))        # history tokens per prompt; older turns are folded
+SUMMARY_TOKEN_BUDGET = int(os.getenv("SUMMARY_TOKEN_BUDGET", "300"))
+
+_FIRST_SENTENCE = re.compile(r"^(.+?[.!?])(\s|$)", re.S)
+
+def summarize(summary: str, messages) -> str:
+    """
+    Folds messages into a running summary: one line per message keeping
+    its first sentence, oldest lines dropped beyond SUMMARY_TOKEN_BUDGET.
+    Cheap and deterministic, so it can run on every turn.
+    """
+    lines = summary.splitlines() if summary else []
+    for m in messages:
+        text = " ".join(m["content"].split())
+        match = _FIRST_SENTENCE.match(text)
+        lines.append(f"{m['role']}: {(match.group(1) if match else text)[:200]}")
+    while len(lines) > 1 and count_tokens("\n".join(lines)) > SUMMARY_TOKEN_BUDGET:
+        lines.pop(0)
+    return "\n".join(lines)
+
+def render_message(message) -> str:
+    return f"{message['role']}: {message['content']}"
+
+class Session:
+    """
+    Messages plus their prompt rendering, maintained incrementally: each
+    message is rendered and token-counted once, when it is added, and
+    `cumulative` holds running token totals so the suffix fitting any
+    budget is found with a bisect instead of re-rendering the history.
+    """
+
+    def __init__(self, messages=None, summary: str = ""):
+        self.messages = []       # {"role", "content", "sources"}
+        self.lines = []          # rendered messages
+        self.cumulative = []     # tokens of every message ever added, up to and including this one
+        self.folded_tokens = 0   # the running total before messages[0]
+        self.summary = summary   # compacted older turns
+        self.last_used = time.time()
+        for message in messages or []:
+            self.append(message)
+
+    @property
+    def tokens(self) -> int:
+        return (self.cumulative[-1] if self.cumulative else self.folded_tokens) - self.folded_tokens
+
+    def append(self, message):
+        line = render_message(message)
+        self.messages.append(message)
+        self.lines.append(line)
+        self.cumulative.append((self.cumulative[-1] if self.cumulative else self.folded_tokens) + count_tokens(line))
+
+    def fold(self, n: int):
+        """Moves the n oldest messages into the summary."""
+        self.summary = summarize(self.summary, self.messages[:n])
+        self.folded_tokens = self.cumulative[n - 1]
+        del self.messages[:n], self.lines[:n], self.cumulative[:n]
+
+    def start_within(self, budget: int) -> int:
+        """Index of the oldest message such that it and everything after fit in budget."""
+        if self.tokens <= budget:
+            return 0
+        return bisect.bisect_left(self.cumulative, self.cumulative[-1] - budget) + 1
+
+    def render(self, budget: int) -> str:
+        start = self.start_within(budget)
+        summary = summarize(self.summary, self.messages[:start]) if start else self.summary
+        lines = self.lines[start:]
+        if summary:
+            return "\n".join([f"Summary of earlier conversation:\n{summary}"] + lines)
+        return "\n".join(lines)
+
+class SessionStore:
+    """
+    Conversation memory with LRU and idle-TTL eviction. Each session keeps
+    at most max_messages messages and max_tokens rendered tokens; older
+    ones are folded into a summary.
+    With a SQLite path, sessions survive restarts and LRU eviction (they
+    are reloaded on next use); TTL expiry removes them from disk too.
+    """
+
+    def __init__(self, max_sessions: int = MEMORY_MAX_SESSIONS, ttl: float = MEMORY_SESSION_TTL,
+                 max_messages: int = MEMORY_MAX_MESSAGES, max_tokens: int = HISTORY_TOKEN_BUDGET,
+                 path: str = MEMORY_DB):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_messages = max_messages
+        self.max_tokens = max_tokens
+        self._sessions = OrderedDict()
+        self._lock = threading.RLock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, summary TEXT NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS messages (session_id TEXT NOT NULL, seq INTEGER NOT NULL, role TEXT NOT NULL, "
+                "content TEXT NOT NULL, sources TEXT NOT NULL, PRIMARY KEY (session_id, seq))"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_sessions_last_used ON sessions (last_used)")
+            self._db.commit()
+
+    # ---------- Persistence ----------
+    def _load(self, session_id: str):
+        if self._db is None:
+            return None
+        row = self._db.execute("SELECT summary, last_used FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        if row is None:
+            return None
+        if time.time() - row[1] > self.ttl:
+            self._delete(session_id)
+            return None
+        messages = [
+            {"role": role, "content": content, "sources": json.loads(sources)}
+            for role, content, sources in self._db.execute(
+                "SELECT role, content, sources FROM messages WHERE session_id = ? ORDER BY seq", (session_id,)
+            )
+        ]
+        return Session(messages, row[0])
+
+    def _delete(self, session_id: str):
+        if self._db is not None:
+            self._db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            self._db.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            self._db.commit()
+
+    def _expire(self):
+        now = time.time()
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if now - session.last_used <= self.ttl:
+                break
+            self._sessions.popitem(last=False)
+            self._delete(session_id)
+        if self._db is not None:
+            for (session_id,) in self._db.execute(
+                "SELECT session_id FROM sessions WHERE last_used < ?", (now - self.ttl,)
+            ).fetchall():
+                self._delete(session_id)
+
+    # ---------- Access ----------
+    def _get(self, session_id: str, create: bool):
+        session = self._sessions.get(session_id)
+        if session is not None and time.time() - session.last_used > self.ttl:
+            del self._sessions[session_id]
+            self._delete(session_id)
+            session = None
+        if session is None:
+            session = self._load(session_id)
+            if session is None and not create:
+                return None
+            session = session or Session()
+            self._sessions[session_id] = session
+            while len(self._sessions) > self.max_sessions:
+                # Persisted sessions are only dropped from memory
+                self._sessions.popitem(last=False)
+        self._sessions.move_to_end(session_id)
+        session.last_used = time.time()
+        return session
+
+    def add_message(self, session_id: str, role: str, content: str, sources=None):
+        message = {"role": role, "content": content, "sources": sources or []}
+        with self._lock:
+            self._expire()
+            session = self._get(session_id, create=True)
+            session.append(message)
+            keep = min(len(session.messages) - session.start_within(self.max_tokens), self.max_messages)
+            folded = len(session.messages) - max(keep, 1)
+            if folded:
+                session.fold(folded)
+            if self._db is not None:
+                seq = self._db.execute(
+                    "SELECT COALESCE(MAX(seq), 0) + 1 FROM messages WHERE session_id = ?", (session_id,)
+                ).fetchone()[0]
+                self._db.execute(
+                    "INSERT INTO messages (session_id, seq, role, content, sources) VALUES (?, ?, ?, ?, ?)",
+                    (session_id, seq, role, content, json.dumps(message["sources"])),
+                )
+                if folded:
+                    self._db.execute(
+                        "DELETE FROM messages WHERE session_id = ? AND seq <= ?",
+                        (session_id, seq - len(session.messages)),
+                    )
+                self._db.execute(
+                    "INSERT OR REPLACE INTO sessions (session_id, summary, last_used) VALUES (?, ?, ?)",
+                    (session_id, session.summary, session.last_used),
+                )
+                self._db.commit()
+
+    def get(self, session_id: str):
+        """Returns (summary, messages) for a session; empty if unknown."""
+        with self._lock:
+            session = self._get(session_id, create=False)
+            if session is None:
+                return "", []
+            return session.summary, list(session.messages)
+
+    def render(self, session_id: str, budget: int) -> str:
+        with self._lock:
+            session = self._get(session_id, create=False)
+            return session.render(budget) if session is not None else ""
+
+    def reset(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            self._delete(session_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "messages": sum(len(s.messages) for s in self._sessions.values()),
+                "persistent": self._db is not None,
+            }
+
+memory_store = SessionStore()
 
 @router.post("/reset_memory/")
 async def reset_memory(session_id: str):
-    memory_store[session_id] = []
+    reset_session(session_id)
     return {"status": "reset"}
 
+def reset_session(session_id: str):
+    memory_store.reset(session_id)
+
 def add_message(session_id: str, role: str, content: str, sources=None):
-    if session_id not in memory_store:
-        memory_store[session_id] = []
-    memory_store[session_id].append({
-        "role": role,
-        "content": content,
-        "sources": sources or []
-    })
+    memory_store.add_message(session_id, role, content, sources)
 
 def get_history(session_id: str):
-    return memory_store.get(session_id, [])
+    return memory_store.get(session_id)[1]
+
+def get_history_text(session_id: str, budget: int = HISTORY_TOKEN_BUDGET) -> str:
+    """
+    Renders history for a prompt: the most recent messages that fit in
+    `budget` tokens, preceded by a summary (at most SUMMARY_TOKEN_BUDGET
+    tokens) of everything older.
+    """
+    return memory_store.render(session_id, budget)
 
 def format_sources_for_frontend(session_id: str):
     """
@@ -37,4 +269,4 @@ def format_sources_for_frontend(session_id: str):
                     "filename": s.get("filename", "unknown"),
                     "preview": s.get("preview", "")  # already cleaned in ingestion
                 })
-    return formatted
\ No newline at end of file
+    return formatted
@@ -1,32 +1,38 @@
-from langchain_openai import ChatOpenAI
-from backend.hybrid_retriever import query_hybrid
+from backend.hybrid_retriever import retrieve_hybrid
+from backend.context import build_context
+from backend.resources import get_llm
+from backend.tracing import llm_config, span, traced
 
 def query_with_memory(session_id: str, question: str, k: int = 3):
-    from backend.mem import add_message, get_history
-    # Get hybrid retrieval context
-    answer, sources = query_hybrid(question, k=k)
-
-    # Build conversation context
-    history = get_history(session_id)
-    history_text = "\n".join([f"{m['role']}: {m['content']}" for m in history])
-
-    llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
-    prompt = f"""
+    from backend.mem import add_message, get_history_text
+    with traced("query_with_memory"):
+        # Hybrid retrieval, packed into the context token budget
+        sources = retrieve_hybrid(question, k=k)
+        # Cite only the chunks that made it into the prompt
+        with span("context"):
+            context, sources = build_context(sources)
+
+        # Build conversation context
+        with span("history"):
+            history_text = get_history_text(session_id)
+
+        llm = get_llm()
+        prompt = f"""
 You are a helpful assistant. Use conversation history and retrieval context.
 
 History:
 {history_text}
 
 Context (retrieved docs):
-{[s['preview'] for s in sources]}
+{context}
 
 User: {question}
 Assistant:"""
 
-    final_answer = llm.invoke(prompt).content
+        final_answer = llm.invoke(prompt, config=llm_config()).content
 
     # Store messages in memory
     add_message(session_id, "user", question)
     add_message(session_id, "assistant", final_answer)
 
-    return final_answer, sources
\ No newline at end of file
+    return final_answer, sources
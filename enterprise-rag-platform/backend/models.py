@@ -1,14 +1,71 @@
-from pydantic import BaseModel
-from typing import List, Dict
+from datetime import datetime
+from pydantic import BaseModel, Field
+from typing import List, Dict, Optional, Literal
 
 class IngestResponse(BaseModel):
     status: str
     file: str
+    chunks: Optional[int] = None
+    pages: Optional[int] = None
+    preview: Optional[str] = None
+    added: Optional[int] = None     # chunks embedded by this upload
+    removed: Optional[int] = None   # chunks of the previous version dropped
 
-class QueryRequest(BaseModel):
+class BatchIngestResponse(BaseModel):
+    job_id: str
+    status: str
+    total: int
+
+class IngestJobStatus(BaseModel):
+    job_id: str
+    status: str   # queued | running | completed | failed
+    total: int
+    extracted: int
+    indexed: int
+    failed: List[Dict]
+    created_at: float
+    finished_at: Optional[float] = None
+
+class QueryFilters(BaseModel):
+    filenames: Optional[List[str]] = None    # any of these files
+    tags: Optional[List[str]] = None         # documents carrying any of these tags
+    uploaded_after: Optional[datetime] = None
+    uploaded_before: Optional[datetime] = None
+
+    def to_options(self) -> dict:
+        # Plain JSON-able values; they are also part of the answer cache key
+        return {
+            "filenames": sorted(self.filenames) if self.filenames else None,
+            "tags": sorted(self.tags) if self.tags else None,
+            "uploaded_after": self.uploaded_after.timestamp() if self.uploaded_after else None,
+            "uploaded_before": self.uploaded_before.timestamp() if self.uploaded_before else None,
+        }
+
+class RetrievalParams(BaseModel):
+    k: int = Field(3, ge=1, le=50)
+    fusion: Literal["rrf", "score"] = "rrf"   # reciprocal-rank or normalized-score fusion
+    dense_weight: float = Field(1.0, ge=0)
+    sparse_weight: float = Field(1.0, ge=0)
+    filters: Optional[QueryFilters] = None
+
+    def retrieval_options(self) -> dict:
+        return {
+            "fusion": self.fusion,
+            "dense_weight": self.dense_weight,
+            "sparse_weight": self.sparse_weight,
+            "filters": self.filters.to_options() if self.filters else None,
+        }
+
+class QueryRequest(RetrievalParams):
     query: str
     session_id: str   # NEW
 
+class StreamQueryRequest(RetrievalParams):
+    # The Streamlit client sends "query"; the session may also come from X-Session-ID
+    question: Optional[str] = None
+    query: Optional[str] = None
+    session_id: Optional[str] = None
+
 class QueryResponse(BaseModel):
     answer: str
     sources: List[Dict]
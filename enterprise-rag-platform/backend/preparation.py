@@ -0,0 +1,27 @@
+from backend.manifest import file_hash
+from backend.chunking import chunk_segments
+from backend.extraction import PreviewTap, iter_segments
+
+# Extraction and chunking only: batch-ingest worker processes import this
+# module, so it must not pull in the indexes (backend.hybrid_retriever
+# opens the sparse index) or the vector store and API clients.
+
+def iter_document_chunks(source, filename: str):
+    """
+    Reads the file once and yields its chunks as pages are parsed.
+    Returns a PreviewTap alongside the generator; its preview/pages fill
+    in as the chunks are consumed.
+    """
+    tap = PreviewTap(iter_segments(source, filename))
+    return tap, chunk_segments(tap, filename)
+
+def prepare_document(source, filename: str) -> dict:
+    """Extracts and chunks a whole file (used by the batch-ingest workers)."""
+    digest = file_hash(source)
+    tap, chunks = iter_document_chunks(source, filename)
+    chunks = list(chunks)
+    return {"filename": filename, "hash": digest, "preview": tap.preview, "pages": tap.pages, "chunks": chunks}
+
+def extract_file(path: str, filename: str) -> dict:
+    # Runs in a worker process: extraction and chunking are the CPU-bound part
+    return prepare_document(path, filename)
@@ -0,0 +1,221 @@
+import os
+import json
+import logging
+import threading
+from collections import Counter
+import httpx
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from langchain_community.vectorstores import Chroma
+from langchain_core.embeddings import Embeddings
+from backend.embedding_cache import CachedEmbeddings
+from backend.local_embeddings import HashingEmbeddings, HASHING_EMBEDDING_DIM, HASHING_NGRAMS
+from backend.vector_store import LocalVectorStore, LOCAL_VECTOR_DIR
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL = "text-embedding-3-large"
+CHAT_MODEL = "gpt-4o-mini"
+VECTOR_STORE_DIR = "vector_store"
+# local: memory-mapped quantized store (backend.vector_store); chroma: persistent Chroma in VECTOR_STORE_DIR
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "local")
+# openai: EMBEDDING_MODEL through the embedding cache; hashing: local feature hashing (backend.local_embeddings).
+# Only applies to a new collection; an existing one keeps the backend (and hashing dim/ngrams) recorded in
+# its EMBEDDING_RECORD.
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "openai")
+EMBEDDING_RECORD = "embedding.json"
+
+# One keep-alive pool per process, shared by every OpenAI client
+HTTP_LIMITS = httpx.Limits(
+    max_connections=int(os.getenv("OPENAI_MAX_CONNECTIONS", "20")),
+    max_keepalive_connections=int(os.getenv("OPENAI_MAX_KEEPALIVE", "10")),
+    keepalive_expiry=float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "60")),
+)
+HTTP_TIMEOUT = httpx.Timeout(float(os.getenv("OPENAI_TIMEOUT", "60")), connect=10.0)
+
+# ---------- Registry ----------
+_lock = threading.RLock()   # factories borrow other resources
+_resources = {}
+_built = Counter()
+_borrowed = Counter()
+_requests = Counter()
+
+def _get(name: str, factory):
+    """
+    Returns the process-wide instance for name, building it on first use.
+    """
+    resource = _resources.get(name)
+    if resource is None:
+        with _lock:
+            resource = _resources.get(name)
+            if resource is None:
+                resource = _resources[name] = factory()
+                _built[name] += 1
+    _borrowed[name] += 1
+    return resource
+
+def _count_request(name):
+    def hook(request):
+        _requests[name] += 1
+    return hook
+
+def _count_request_async(name):
+    async def hook(request):
+        _requests[name] += 1
+    return hook
+
+# ---------- Resources ----------
+def get_http_client() -> httpx.Client:
+    return _get("http_client", lambda: httpx.Client(
+        limits=HTTP_LIMITS,
+        timeout=HTTP_TIMEOUT,
+        event_hooks={"request": [_count_request("http_client")]},
+    ))
+
+def get_async_http_client() -> httpx.AsyncClient:
+    return _get("async_http_client", lambda: httpx.AsyncClient(
+        limits=HTTP_LIMITS,
+        timeout=HTTP_TIMEOUT,
+        event_hooks={"request": [_count_request_async("async_http_client")]},
+    ))
+
+def _collection_dir() -> str:
+    return VECTOR_STORE_DIR if VECTOR_BACKEND == "chroma" else LOCAL_VECTOR_DIR
+
+def _configured_embedding() -> dict:
+    if EMBEDDING_BACKEND == "hashing":
+        return {"backend": "hashing", "dim": HASHING_EMBEDDING_DIM, "ngrams": HASHING_NGRAMS}
+    return {"backend": EMBEDDING_BACKEND}
+
+def _write_embedding_record(record: str, settings: dict):
+    tmp = record + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(settings, f)
+    os.replace(tmp, record)
+
+def collection_embedding() -> dict:
+    """
+    The embedding settings of the configured collection: {"backend"},
+    plus "dim" and "ngrams" for hashing. Recorded when the collection is
+    first opened, so vectors are never mixed with query embeddings from
+    another backend, or of another width, after the environment changes.
+    """
+    directory = _collection_dir()
+    record = os.path.join(directory, EMBEDDING_RECORD)
+    try:
+        with open(record) as f:
+            settings = json.load(f)
+    except FileNotFoundError:
+        # Collections created before backends were recorded were all OpenAI
+        existing = os.path.isdir(directory) and os.listdir(directory)
+        settings = {"backend": "openai"} if existing else _configured_embedding()
+        os.makedirs(directory, exist_ok=True)
+        _write_embedding_record(record, settings)
+    if settings["backend"] == "hashing" and not {"dim", "ngrams"} <= settings.keys():
+        # Recorded before the hashing parameters were; the current ones are the best guess
+        settings = {"backend": "hashing", "dim": HASHING_EMBEDDING_DIM, "ngrams": HASHING_NGRAMS, **settings}
+        _write_embedding_record(record, settings)
+    configured = _configured_embedding()
+    if settings != configured:
+        logger.warning("Collection in %s uses embeddings %s; ignoring the configured %s",
+                       directory, settings, configured)
+    return settings
+
+def _build_embeddings():
+    settings = collection_embedding()
+    backend = settings["backend"]
+    if backend == "hashing":
+        # Cheaper to recompute than to look up, so not cached
+        return HashingEmbeddings(dim=settings["dim"], ngrams=settings["ngrams"])
+    if backend == "openai":
+        # Both query embedding and ingestion go through the cache
+        return CachedEmbeddings(
+            OpenAIEmbeddings(
+                model=EMBEDDING_MODEL,
+                http_client=get_http_client(),
+                http_async_client=get_async_http_client(),
+            ),
+            model=EMBEDDING_MODEL,
+        )
+    raise ValueError(f"Unknown embedding backend: {backend}")
+
+def get_embeddings() -> Embeddings:
+    """Embeddings of the configured collection, shared by ingestion, retrieval and the answer cache."""
+    return _get("embeddings", _build_embeddings)
+
+def get_llm() -> ChatOpenAI:
+    # invoke() and astream() both work off the same instance
+    return _get("llm", lambda: ChatOpenAI(
+        model=CHAT_MODEL,
+        temperature=0,
+        stream_usage=True,   # token usage on the last streamed chunk, for tracing
+        http_client=get_http_client(),
+        http_async_client=get_async_http_client(),
+    ))
+
+def _build_vector_store():
+    if VECTOR_BACKEND == "chroma":
+        return Chroma(persist_directory=VECTOR_STORE_DIR, embedding_function=get_embeddings())
+    if VECTOR_BACKEND == "local":
+        return LocalVectorStore(embedding=get_embeddings())
+    raise ValueError(f"Unknown VECTOR_BACKEND: {VECTOR_BACKEND}")
+
+def get_vector_store():
+    """The one vector store ingestion writes to and every retriever searches."""
+    return _get("vector_store", _build_vector_store)
+
+# ---------- Lifecycle ----------
+def warm_up():
+    """
+    Builds every resource up front and opens a keep-alive connection to
+    the OpenAI API, so the first request doesn't pay for construction or
+    the TLS handshake.
+    """
+    get_llm()
+    get_vector_store()
+    if os.getenv("OPENAI_WARM_UP", "1") == "1":
+        base_url = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+        try:
+            get_http_client().get(
+                f"{base_url}/models",
+                headers={"Authorization": f"Bearer {os.getenv('OPENAI_API_KEY', '')}"},
+            )
+        except httpx.HTTPError as e:
+            logger.warning("OpenAI connection warm-up failed: %s", e)
+    logger.info("Resources ready: %s", ", ".join(sorted(_resources)))
+
+async def close():
+    """Releases pooled connections; called on FastAPI shutdown."""
+    client = _resources.get("http_client")
+    if client is not None:
+        client.close()
+    async_client = _resources.get("async_http_client")
+    if async_client is not None:
+        await async_client.aclose()
+    _resources.clear()
+
+def _pool_stats(name):
+    client = _resources.get(name)
+    if client is None:
+        return None
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    connections = list(getattr(pool, "connections", []))
+    idle = sum(1 for c in connections if c.is_idle())
+    return {
+        "open_connections": len(connections),
+        "idle_connections": idle,
+        "active_connections": len(connections) - idle,
+        "max_connections": HTTP_LIMITS.max_connections,
+        "max_keepalive_connections": HTTP_LIMITS.max_keepalive_connections,
+        "requests": _requests[name],
+    }
+
+def pool_stats():
+    return {
+        "resources": {
+            name: {"built": _built[name], "borrowed": _borrowed[name]}
+            for name in sorted(_built)
+        },
+        "http_pools": {
+            name: _pool_stats(name) for name in ("http_client", "async_http_client")
+        },
+    }
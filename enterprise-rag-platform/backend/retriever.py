@@ -1,17 +1,12 @@
 from langchain.chains import RetrievalQA
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain_community.vectorstores import Chroma
-import chromadb
-
-client = chromadb.Client()
-collection = client.get_or_create_collection("docs")
+from backend.resources import get_llm, get_vector_store
+from backend.tracing import llm_config, traced
 
 def query_docs(question: str):
-    embeddings = OpenAIEmbeddings(model="text-embedding-3-large")
-    vectordb = Chroma(client=client, collection_name="docs", embedding_function=embeddings)
+    vectordb = get_vector_store()
 
     retriever = vectordb.as_retriever(search_kwargs={"k": 3})
-    llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
+    llm = get_llm()
 
     qa = RetrievalQA.from_chain_type(
         llm=llm,
@@ -20,7 +15,9 @@ def query_docs(question: str):
         return_source_documents=True
     )
     
-    result = qa.invoke({"query": question})
+    # Retriever and LLM runs are timed through the chain's callbacks
+    with traced("query_docs"):
+        result = qa.invoke({"query": question}, config=llm_config())
     answer = result["result"]
 
     # Build structured sources
@@ -0,0 +1,498 @@
+import os
+import json
+import math
+import shutil
+import threading
+from array import array
+from collections import Counter
+
+import numpy as np
+
+INDEX_FILE = "index.json"
+VOCAB_FILE = "vocab.jsonl"
+FORMAT = 2         # 1: UTF-8 term blobs per segment; 2: integer term ids with a shared vocabulary
+MERGE_FACTOR = 8   # merge this many same-sized segments into one
+
+
+class Vocabulary:
+    """
+    Interns terms as dense integer ids. Append-only, so an id never
+    changes and segments store ids instead of term strings.
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.terms = []
+
+    def __len__(self):
+        return len(self.terms)
+
+    def get(self, term: str):
+        return self.ids.get(term)
+
+    def intern(self, term: str) -> int:
+        i = self.ids.get(term)
+        if i is None:
+            i = len(self.terms)
+            # Term first: a reader that finds the id can always resolve it
+            self.terms.append(term)
+            self.ids[term] = i
+        return i
+
+    def append_to(self, path: str, start: int):
+        """Appends terms interned since `start` to the vocabulary file."""
+        if start < len(self.terms):
+            with open(path, "a", encoding="utf-8") as f:
+                f.writelines(json.dumps(t) + "\n" for t in self.terms[start:])
+
+    @classmethod
+    def load(cls, path: str, size: int):
+        """Reads the first `size` terms, dropping any tail a failed flush left behind."""
+        vocab = cls()
+        if not os.path.exists(path):
+            return vocab
+        with open(path, "rb") as f:
+            for _ in range(size):
+                vocab.intern(json.loads(f.readline()))
+            end = f.tell()
+        if os.path.getsize(path) > end:
+            with open(path, "r+b") as f:
+                f.truncate(end)
+        return vocab
+
+
+class _MemorySegment:
+    """Append-only segment holding documents added since the last flush."""
+
+    def __init__(self, start: int):
+        self.start = start
+        self.postings = {}          # term id -> (doc ids, term frequencies)
+        self.doc_lengths = array("I")
+
+    @property
+    def num_docs(self) -> int:
+        return len(self.doc_lengths)
+
+    @property
+    def lengths(self):
+        return np.array(self.doc_lengths, dtype=np.uint32)
+
+    def add(self, term_ids) -> int:
+        doc = self.start + len(self.doc_lengths)
+        for term, freq in Counter(term_ids).items():
+            entry = self.postings.get(term)
+            if entry is None:
+                entry = self.postings[term] = (array("I"), array("I"))
+            entry[0].append(doc)
+            entry[1].append(freq)
+        self.doc_lengths.append(len(term_ids))
+        return doc
+
+    def get(self, term: int):
+        entry = self.postings.get(term)
+        if entry is None:
+            return None
+        return np.array(entry[0], dtype=np.uint32), np.array(entry[1], dtype=np.uint32)
+
+    def snapshot(self, terms):
+        """Copies the postings of `terms` and the doc lengths, for reading without the lock."""
+        postings = {}
+        for term in terms:
+            found = self.get(term)
+            if found is not None:
+                postings[term] = found
+        return _SegmentView(self.start, postings, self.lengths)
+
+    def write(self, path: str):
+        terms = sorted(self.postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(self.postings[t][0]) for t in terms])
+        docs = np.empty(offsets[-1], dtype=np.uint32)
+        tfs = np.empty(offsets[-1], dtype=np.uint32)
+        for i, term in enumerate(terms):
+            docs[offsets[i]:offsets[i + 1]] = self.postings[term][0]
+            tfs[offsets[i]:offsets[i + 1]] = self.postings[term][1]
+        _write_segment(path, np.array(terms, dtype=np.uint32), offsets, docs, tfs, self.lengths)
+
+
+class _SegmentView:
+    """Point-in-time copy of part of a _MemorySegment; never changes."""
+
+    def __init__(self, start: int, postings: dict, lengths):
+        self.start = start
+        self.postings = postings
+        self.lengths = lengths
+
+    def get(self, term: int):
+        return self.postings.get(term)
+
+
+def _write_segment(path: str, terms, postings_offsets, docs, tfs, lengths):
+    """
+    Writes a segment in the on-disk layout read by _DiskSegment: sorted
+    term ids, concatenated postings arrays with per-term offsets, and the
+    doc-length array.
+    """
+    if os.path.exists(path):
+        # leftover from a flush that died before the manifest was written
+        shutil.rmtree(path)
+    os.makedirs(path)
+    np.save(os.path.join(path, "terms.npy"), np.asarray(terms, dtype=np.uint32))
+    np.save(os.path.join(path, "postings_offsets.npy"), np.asarray(postings_offsets, dtype=np.int64))
+    np.save(os.path.join(path, "docs.npy"), np.asarray(docs, dtype=np.uint32))
+    np.save(os.path.join(path, "tfs.npy"), np.asarray(tfs, dtype=np.uint32))
+    np.save(os.path.join(path, "lengths.npy"), np.asarray(lengths, dtype=np.uint32))
+
+
+def _merge_postings(parts):
+    """
+    Merges (term per posting, doc ids, tfs) triples, given in doc order,
+    into one sorted postings layout: (terms, offsets, docs, tfs). A stable
+    sort on the term keeps each term's doc ids ascending.
+    """
+    if not parts:
+        empty = np.zeros(0, dtype=np.uint32)
+        return empty, np.zeros(1, dtype=np.int64), empty, empty
+    terms = np.concatenate([t for t, _, _ in parts])
+    order = np.argsort(terms, kind="stable")
+    terms = terms[order]
+    docs = np.concatenate([d for _, d, _ in parts])[order]
+    tfs = np.concatenate([f for _, _, f in parts])[order]
+    unique, counts = np.unique(terms, return_counts=True)
+    offsets = np.zeros(len(unique) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(counts)
+    return unique, offsets, docs, tfs
+
+
+class _DiskSegment:
+    """Immutable, memory-mapped segment. Nothing is parsed at load time."""
+
+    def __init__(self, path: str, start: int):
+        self.path = path
+        self.start = start
+        self.terms = np.load(os.path.join(path, "terms.npy"), mmap_mode="r")
+        self.postings_offsets = np.load(os.path.join(path, "postings_offsets.npy"), mmap_mode="r")
+        self.docs = np.load(os.path.join(path, "docs.npy"), mmap_mode="r")
+        self.tfs = np.load(os.path.join(path, "tfs.npy"), mmap_mode="r")
+        self.lengths = np.load(os.path.join(path, "lengths.npy"), mmap_mode="r")
+
+    @property
+    def num_docs(self) -> int:
+        return len(self.lengths)
+
+    def _find(self, term: int):
+        i = int(np.searchsorted(self.terms, term))
+        if i < len(self.terms) and self.terms[i] == term:
+            return self.postings_offsets[i], self.postings_offsets[i + 1]
+        return None
+
+    def get(self, term: int):
+        span = self._find(term)
+        if span is None:
+            return None
+        lo, hi = span
+        return self.docs[lo:hi], self.tfs[lo:hi]
+
+    def triples(self):
+        """Returns (term id per posting, doc ids, term frequencies) as flat arrays."""
+        terms = np.repeat(np.asarray(self.terms), np.diff(self.postings_offsets))
+        return terms, np.asarray(self.docs), np.asarray(self.tfs)
+
+
+class SparseIndex:
+    """
+    Incremental inverted index with BM25 scoring.
+
+    Adding a document only touches the postings of its own terms, and the
+    document-frequency / average-length statistics are kept as running
+    totals, so ingest cost is O(new tokens) regardless of corpus size.
+    Queries walk only the postings of the query terms.
+
+    The index is a list of immutable memory-mapped segments on disk plus
+    one in-memory segment for documents added since the last flush().
+    Flushing writes only the new documents, so persisting stays
+    proportional to what was ingested.
+
+    Deleted documents are tombstoned: they keep their postings (and their
+    share of the corpus statistics) but never score.
+
+    Terms are interned in a Vocabulary shared by all segments, so postings
+    are keyed by integer ids and the term strings are stored once.
+
+    Writers (add_document, delete_document, flush) must be serialized by
+    the caller; queries may run concurrently with them. A query reads a
+    snapshot taken under `_lock` (corpus size, segment list, its terms'
+    in-memory postings, tombstones), so it never sees a document that is
+    only half added or a segment list in the middle of a flush.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75, path: str = None):
+        self.k1 = k1
+        self.b = b
+        self.path = path
+        self.segments = []
+        self.total_length = 0
+        self._next_segment = 1
+        self._obsolete = []
+        self._memory = _MemorySegment(0)
+        self.deleted = set()
+        self.meta = {}              # caller-owned values saved with the manifest
+        self.vocab = Vocabulary()
+        self._vocab_flushed = 0     # terms already in the vocabulary file
+        self._dirty = False
+        self._deleted_ids = None
+        self._lock = threading.Lock()   # guards what readers snapshot
+
+    def __len__(self):
+        return self._memory.start + self._memory.num_docs
+
+    @property
+    def avgdl(self) -> float:
+        return self.total_length / len(self) if len(self) else 0.0
+
+    def add_document(self, tokens) -> int:
+        term_ids = [self.vocab.intern(t) for t in tokens]
+        with self._lock:
+            self.total_length += len(tokens)
+            return self._memory.add(term_ids)
+
+    def delete_document(self, doc: int):
+        with self._lock:
+            if doc not in self.deleted:
+                self.deleted.add(doc)
+                self._deleted_ids = None
+                self._dirty = True
+
+    @property
+    def live_docs(self) -> int:
+        return len(self) - len(self.deleted)
+
+    def _snapshot(self, term_ids):
+        """(num docs, avgdl, segments, tombstoned ids) as of one instant."""
+        with self._lock:
+            n = len(self)
+            avgdl = self.total_length / n if n else 0.0
+            segments = self.segments + [self._memory.snapshot(term_ids)]
+            if self._deleted_ids is None:
+                self._deleted_ids = np.fromiter(self.deleted, dtype=np.int64, count=len(self.deleted))
+            return n, avgdl, segments, self._deleted_ids
+
+    def doc_freq(self, term: str) -> int:
+        term_id = self.vocab.get(term)
+        if term_id is None:
+            return 0
+        _, _, segments, _ = self._snapshot([term_id])
+        return sum(len(p[0]) for p in (seg.get(term_id) for seg in segments) if p is not None)
+
+    def idf(self, term: str) -> float:
+        return self._idf(self.doc_freq(term), len(self))
+
+    @staticmethod
+    def _idf(df: int, n: int) -> float:
+        # Lucene-style idf: always positive, so very common terms never
+        # push a document's score below documents that lack them.
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def score(self, query_tokens, allowed=None):
+        """
+        Returns a score array indexed by doc id. Only documents containing
+        a query term are touched; everything else stays 0. With `allowed`
+        (doc ids), postings are cut down to those documents before any
+        scoring work; idf still comes from the whole corpus.
+        """
+        term_ids = (self.vocab.get(t) for t in query_tokens)
+        query = Counter(t for t in term_ids if t is not None)
+        n, avgdl, segments, deleted_ids = self._snapshot(query)
+        scores = np.zeros(n, dtype=np.float64)
+        if not n:
+            return scores
+        mask = None
+        if allowed is not None:
+            allowed = np.asarray(allowed, dtype=np.int64)
+            mask = np.zeros(n, dtype=bool)
+            # Documents added after the snapshot aren't scored anyway
+            mask[allowed[allowed < n]] = True
+        k1, b = self.k1, self.b
+        for term, qf in query.items():
+            hits = [(seg, seg.get(term)) for seg in segments]
+            hits = [(seg, p) for seg, p in hits if p is not None and len(p[0])]
+            if not hits:
+                continue
+            idf = self._idf(sum(len(p[0]) for _, p in hits), n) * qf
+            for seg, (docs, tfs) in hits:
+                if mask is not None:
+                    keep = mask[docs]
+                    docs, tfs = docs[keep], tfs[keep]
+                tf = tfs.astype(np.float64)
+                lengths = seg.lengths[docs - seg.start]
+                norm = k1 * (1 - b + b * lengths / avgdl)
+                # doc ids are unique within one term's postings
+                scores[docs] += idf * tf * (k1 + 1) / (tf + norm)
+        if len(deleted_ids):
+            scores[deleted_ids[deleted_ids < n]] = 0
+        return scores
+
+    def top_k(self, query_tokens, k: int, allowed=None):
+        """Returns up to k (doc id, score) pairs, best first."""
+        scores = self.score(query_tokens, allowed)
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > k:
+            # Partial selection: O(n) to find the k best, then sort only those
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        best = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [(int(doc), float(scores[doc])) for doc in best]
+
+    # ---------- Persistence ----------
+    def flush(self):
+        """
+        Writes documents added since the last flush as a new segment and
+        atomically updates the segment manifest (which also records
+        deletions).
+        """
+        if self.path is None:
+            return
+        if not self._memory.num_docs:
+            if self._dirty:
+                self._write_manifest()
+            return
+        os.makedirs(self.path, exist_ok=True)
+        self._flush_vocab()
+        seg_path = self._new_segment_path()
+        self._memory.write(seg_path)
+        start = self._memory.start
+        segment = _DiskSegment(seg_path, start)
+        with self._lock:
+            # New list, so a reader's snapshot never changes under it
+            self.segments = self.segments + [segment]
+            self._memory = _MemorySegment(start + self._memory.num_docs)
+        self._maybe_merge()
+        self._write_manifest()
+
+    def _flush_vocab(self):
+        # Terms are appended before the manifest that commits them
+        self.vocab.append_to(os.path.join(self.path, VOCAB_FILE), self._vocab_flushed)
+        self._vocab_flushed = len(self.vocab)
+
+    def _new_segment_path(self) -> str:
+        name = f"seg-{self._next_segment:06d}"
+        self._next_segment += 1
+        return os.path.join(self.path, name)
+
+    def _maybe_merge(self):
+        # Size-tiered merging: once MERGE_FACTOR trailing segments share a
+        # size tier they are folded into one, so every document is
+        # rewritten O(log N) times and queries see O(log N) segments.
+        def tier(seg):
+            return int(math.log(max(seg.num_docs, 1), MERGE_FACTOR))
+
+        while True:
+            tail = self.segments[-MERGE_FACTOR:]
+            if len(tail) < MERGE_FACTOR or len({tier(seg) for seg in tail}) != 1:
+                break
+            postings = _merge_postings([seg.triples() for seg in tail])
+            lengths = np.concatenate([seg.lengths for seg in tail])
+            seg_path = self._new_segment_path()
+            _write_segment(seg_path, *postings, lengths)
+            merged = _DiskSegment(seg_path, tail[0].start)
+            with self._lock:
+                self.segments = self.segments[:-MERGE_FACTOR] + [merged]
+            self._obsolete.extend(seg.path for seg in tail)
+
+    def compacted(self):
+        """
+        Writes a copy of the index without tombstoned documents, as a single
+        segment with the survivors renumbered in order. Returns
+        (new index, remap) where remap[old doc id] is the new id or -1.
+        Call flush() on this index first so no documents are only in memory;
+        the new index takes over the manifest when it is flushed. This
+        index stays readable (its files are memory-mapped) until dropped.
+        """
+        remap = np.full(len(self), -1, dtype=np.int64)
+        live = np.ones(len(self), dtype=bool)
+        live[list(self.deleted)] = False
+        remap[live] = np.arange(int(live.sum()))
+
+        parts = []
+        for seg in self.segments:
+            terms, docs, tfs = seg.triples()
+            new_docs = remap[docs]
+            keep = new_docs >= 0
+            parts.append((terms[keep], new_docs[keep].astype(np.uint32), tfs[keep]))
+        postings = _merge_postings(parts)
+        lengths = np.concatenate([seg.lengths for seg in self.segments]) if self.segments \
+            else np.zeros(0, dtype=np.uint32)
+        lengths = lengths[live]
+
+        index = SparseIndex(k1=self.k1, b=self.b, path=self.path)
+        index._next_segment = self._next_segment
+        index.meta = dict(self.meta)
+        # Term ids stay valid, so the vocabulary (and its file) carries over
+        index.vocab = self.vocab
+        index._vocab_flushed = self._vocab_flushed
+        seg_path = index._new_segment_path()
+        _write_segment(seg_path, *postings, lengths)
+        index.segments = [_DiskSegment(seg_path, 0)]
+        index.total_length = int(lengths.sum())
+        index._memory = _MemorySegment(len(lengths))
+        index._obsolete = [seg.path for seg in self.segments]
+        index._dirty = True
+        return index, remap
+
+    def _write_manifest(self):
+        manifest = {
+            "format": FORMAT,
+            "k1": self.k1,
+            "b": self.b,
+            "num_docs": len(self),
+            "total_length": self.total_length,
+            "segments": [os.path.basename(seg.path) for seg in self.segments],
+            "next_segment": self._next_segment,
+            "vocab_size": self._vocab_flushed,
+            "deleted": sorted(self.deleted),
+            "meta": self.meta,
+        }
+        tmp = os.path.join(self.path, INDEX_FILE + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp, os.path.join(self.path, INDEX_FILE))
+        self._dirty = False
+        # Merged-away segments are only dropped once the manifest no longer
+        # references them
+        for path in self._obsolete:
+            shutil.rmtree(path, ignore_errors=True)
+        self._obsolete = []
+
+    @staticmethod
+    def read_manifest(path: str):
+        """Returns the saved manifest, or None if nothing was saved yet."""
+        manifest_path = os.path.join(path, INDEX_FILE)
+        if not os.path.exists(manifest_path):
+            return None
+        with open(manifest_path) as f:
+            return json.load(f)
+
+    @classmethod
+    def load(cls, path: str):
+        """
+        Memory-maps a flushed index. Returns None if nothing was saved yet.
+        Raises ValueError for an index written in an older FORMAT.
+        """
+        manifest = cls.read_manifest(path)
+        if manifest is None:
+            return None
+        if manifest.get("format", 1) != FORMAT:
+            raise ValueError(f"Sparse index in {path} has format {manifest.get('format', 1)}, expected {FORMAT}")
+        index = cls(k1=manifest["k1"], b=manifest["b"], path=path)
+        start = 0
+        for name in manifest["segments"]:
+            seg = _DiskSegment(os.path.join(path, name), start)
+            index.segments.append(seg)
+            start += seg.num_docs
+        index.total_length = manifest["total_length"]
+        index._next_segment = manifest["next_segment"]
+        index.deleted = set(manifest.get("deleted", []))
+        index.meta = manifest.get("meta", {})
+        index.vocab = Vocabulary.load(os.path.join(path, VOCAB_FILE), manifest["vocab_size"])
+        index._vocab_flushed = manifest["vocab_size"]
+        index._memory = _MemorySegment(start)
+        return index
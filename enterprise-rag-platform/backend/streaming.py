@@ -1,28 +1,76 @@
+import re
 import json
+import time
+import logging
+from fastapi import Request
 from fastapi.responses import StreamingResponse
-from langchain_openai import ChatOpenAI
-from langchain.callbacks.base import BaseCallbackHandler
-from backend.mem import add_message, get_history
-from backend.hybrid_retriever import query_hybrid
+from starlette.concurrency import run_in_threadpool
+from backend.mem import add_message, get_history_text
+from backend.hybrid_retriever import retrieve_hybrid
+from backend.context import build_context
+from backend.resources import get_llm
+from backend.answer_cache import answer_cache, scope_key
+from backend.tracing import current_trace, llm_config, span
 
-class StreamHandler(BaseCallbackHandler):
-    def __init__(self):
-        self.queue = []
+logger = logging.getLogger(__name__)
 
-    def on_llm_new_token(self, token: str, **kwargs):
-        self.queue.append(token)
+def _sse(payload: dict) -> str:
+    return f"data: {json.dumps(payload)}\n\n"
 
-def stream_sse_with_memory(session_id: str, question: str, k: int = 3):
+def _done() -> dict:
+    # Per-stage timings and token counts ride along on the final event,
+    # since the Server-Timing header goes out before the answer is generated
+    trace = current_trace()
+    return {'type': 'done', 'timing': trace.summary()} if trace is not None else {'type': 'done'}
+
+def _replay(session_id: str, question: str, cached: dict, started: float) -> StreamingResponse:
+    """Streams a cached answer with the same events as a live one."""
+
+    async def event_generator():
+        # Word-sized pieces keep the client's incremental rendering path
+        for token in re.findall(r"\S+\s*", cached["answer"]):
+            yield _sse({'type': 'token', 'value': token})
+        add_message(session_id, "user", question)
+        add_message(session_id, "assistant", cached["answer"])
+        yield _sse({'type': 'sources', 'value': cached["sources"]})
+        yield _sse({**_done(), 'cached': True})
+        logger.info("query_sse_memory session=%s cache hit (similarity=%.3f) total=%.3fs",
+                    session_id, cached["similarity"], time.perf_counter() - started)
+
+    return StreamingResponse(event_generator(), media_type="text/event-stream")
+
+async def stream_sse_with_memory(session_id: str, question: str, k: int = 3, request: Request = None,
+                                 **retrieval_options):
     """
     Stream JSON events over SSE with retrieval + memory.
     Events include tokens, sources, and final done signal.
+
+    Tokens are forwarded as the LLM produces them. If the client goes away
+    the generator is closed, which closes the upstream LLM stream too.
+
+    A near-duplicate of an earlier question with the same history is
+    replayed from the answer cache without retrieval or an LLM call.
     """
-    # Get hybrid retrieval
-    _, sources = query_hybrid(question, k=k)
+    started = time.perf_counter()
+
+    # Conversation history, recent turns plus a summary within the token budget
+    with span("history"):
+        history_text = get_history_text(session_id)
 
-    # Conversation history
-    history = get_history(session_id)
-    history_text = "\n".join([f"{m['role']}: {m['content']}" for m in history])
+    if answer_cache.enabled:
+        with span("answer_cache"):
+            version = answer_cache.version
+            scope = scope_key(endpoint="query_sse_memory", k=k, history=history_text, **retrieval_options)
+            vector = await run_in_threadpool(answer_cache.embed, question)
+            cached = answer_cache.lookup(vector, scope)
+        if cached is not None:
+            return _replay(session_id, question, cached, started)
+
+    # Get hybrid retrieval (blocking, so keep it off the event loop)
+    sources = await run_in_threadpool(retrieve_hybrid, question, k, **retrieval_options)
+    # Cite only the chunks that made it into the prompt
+    with span("context"):
+        context, sources = await run_in_threadpool(build_context, sources)
 
     # Prompt
     prompt = f"""
@@ -32,31 +80,48 @@ History:
 {history_text}
 
 Retrieved context:
-{[s['preview'] for s in sources]}
+{context}
 
 User: {question}
 Assistant:
 """
 
-    # Streaming setup
-    handler = StreamHandler()
-    llm = ChatOpenAI(model="gpt-4o-mini", temperature=0, streaming=True, callbacks=[handler])
-    llm.invoke(prompt)
+    llm = get_llm()
+
+    async def event_generator():
+        parts = []
+        first_token_at = None
+        stream = llm.astream(prompt, config=llm_config())
+        try:
+            # Stream tokens as they arrive
+            async for chunk in stream:
+                if request is not None and await request.is_disconnected():
+                    logger.info("query_sse_memory session=%s: client disconnected, generation cancelled", session_id)
+                    return
+                token = chunk.content
+                if not token:
+                    continue
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                    logger.info("query_sse_memory session=%s ttft=%.3fs", session_id, first_token_at - started)
+                parts.append(token)
+                yield _sse({'type': 'token', 'value': token})
+        finally:
+            # Also runs when the response is torn down mid-stream
+            await stream.aclose()
 
-    def event_generator():
-        # Stream tokens
-        for token in handler.queue:
-            yield f"data: {json.dumps({'type': 'token', 'value': token})}\n\n"
-        
         # Final combined answer
-        final_answer = "".join(handler.queue).strip()
+        final_answer = "".join(parts).strip()
         add_message(session_id, "user", question)
         add_message(session_id, "assistant", final_answer)
+        if answer_cache.enabled:
+            answer_cache.store(vector, scope, version, final_answer, sources)
 
         # Send sources
-        yield f"data: {json.dumps({'type': 'sources', 'value': sources})}\n\n"
+        yield _sse({'type': 'sources', 'value': sources})
 
         # Done signal
-        yield f"data: {json.dumps({'type': 'done'})}\n\n"
+        yield _sse(_done())
+        logger.info("query_sse_memory session=%s total=%.3fs", session_id, time.perf_counter() - started)
 
-    return StreamingResponse(event_generator(), media_type="text/event-stream")
\ No newline at end of file
+    return StreamingResponse(event_generator(), media_type="text/event-stream")
@@ -0,0 +1,92 @@
+import os
+import re
+import unicodedata
+from functools import lru_cache
+
+SPARSE_STEMMING = os.getenv("SPARSE_STEMMING", "0") == "1"     # light suffix stripping
+SPARSE_STOPWORDS = os.getenv("SPARSE_STOPWORDS", "0") == "1"   # drop common English function words
+# Bump when stem() changes; a stemmed index built with another version is rebuilt on load
+STEMMER_VERSION = 2
+
+_WORD = re.compile(r"\w+")
+
+STOPWORDS = frozenset("""
+a about above after again against all am an and any are as at be because been before being below between
+both but by can could did do does doing down during each few for from further had has have having he her
+here hers herself him himself his how i if in into is it its itself just me more most my myself no nor not
+now of off on once only or other our ours ourselves out over own same she should so some such than that
+the their theirs them themselves then there these they this those through to too under until up very was
+we were what when where which while who whom why will with would you your yours yourself yourselves
+""".split())
+
+# (suffix, replacement), first match wins; the stem must keep at least 3 characters
+_SUFFIXES = (
+    ("sses", "ss"), ("ies", "y"), ("ss", "ss"), ("us", "us"), ("is", "is"), ("s", ""),
+    ("ingly", ""), ("edly", ""), ("ing", ""), ("ed", ""), ("ly", ""),
+)
+_VERB_SUFFIXES = ("ingly", "edly", "ing", "ed")
+_VOWELS = frozenset("aeiou")
+# consonant-vowel-consonant ending, the last not w/x/y: "fil", "hop"
+_SHORT_END = re.compile(r"[^aeiou][aeiouy][^aeiouwxy]$")
+
+
+def _restore(base: str) -> str:
+    # Porter step 1b clean-up, so "filed" meets "file" and "stopped" meets "stop"
+    if base.endswith(("at", "bl", "iz")):
+        return base + "e"
+    if base[-1] == base[-2] and base[-1] not in _VOWELS and base[-1] not in "lsz":
+        return base[:-1]
+    if _SHORT_END.search(base) and sum(c in _VOWELS for c in base[:-1]) == 1:
+        return base + "e"
+    return base
+
+
+@lru_cache(maxsize=100_000)
+def stem(word: str) -> str:
+    """
+    Strips one common inflectional suffix ("reports" -> "report",
+    "filed" -> "file", "stopped" -> "stop"). Light by design: irregular
+    forms ("ran") are left alone, and a short stem ending
+    consonant-vowel-consonant always gains an "e" ("hoping" -> "hope"),
+    also where the word has none ("bused" -> "buse", not "bus").
+    """
+    if len(word) <= 3 or not word.isalpha():
+        return word
+    for suffix, replacement in _SUFFIXES:
+        if word.endswith(suffix):
+            base = word[:len(word) - len(suffix)]
+            if len(base) < 3:
+                return word
+            return _restore(base) if suffix in _VERB_SUFFIXES else base + replacement
+    return word
+
+
+class Tokenizer:
+    """
+    Sparse-retrieval tokenizer: NFKC-normalizes and case-folds the text,
+    splits it into word characters (so "Revenue," and "revenue" are the
+    same term), then optionally drops stopwords and stems.
+    """
+
+    def __init__(self, stemming: bool = SPARSE_STEMMING, stopwords: bool = SPARSE_STOPWORDS):
+        self.stemming = stemming
+        self.stopwords = stopwords
+
+    @property
+    def config(self) -> dict:
+        config = {"stemming": self.stemming, "stopwords": self.stopwords}
+        if self.stemming:
+            config["stemmer"] = STEMMER_VERSION
+        return config
+
+    @classmethod
+    def from_config(cls, config: dict):
+        return cls(stemming=config.get("stemming", False), stopwords=config.get("stopwords", False))
+
+    def __call__(self, text: str):
+        words = _WORD.findall(unicodedata.normalize("NFKC", text).casefold())
+        if self.stopwords:
+            words = [w for w in words if w not in STOPWORDS]
+        if self.stemming:
+            words = [stem(w) for w in words]
+        return words
@@ -0,0 +1,50 @@
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+# cl100k_base is what text-embedding-3-* counts in; close enough for gpt-4o-mini budgets
+ENCODING_NAME = "cl100k_base"
+
+_WORD_RE = re.compile(r"\w+|[^\w\s]")
+_encoding = None
+_loaded = False
+
+def get_encoding():
+    """
+    Returns the tiktoken encoding, or None when it can't be loaded (tiktoken
+    downloads its BPE files on first use, which fails on offline hosts).
+    """
+    global _encoding, _loaded
+    if not _loaded:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(ENCODING_NAME)
+        except Exception as e:
+            logger.warning("tiktoken unavailable (%s); using word-based token estimates", e)
+        _loaded = True
+    return _encoding
+
+def count_tokens(text: str) -> int:
+    enc = get_encoding()
+    if enc is not None:
+        return len(enc.encode(text, disallowed_special=()))
+    # Words and punctuation marks: a slight overestimate of BPE tokens
+    return len(_WORD_RE.findall(text))
+
+def split_tokens(text: str, max_tokens: int, overlap: int = 0):
+    """
+    Splits text into windows of at most max_tokens tokens, consecutive
+    windows sharing `overlap` tokens. Used for sentences too long to chunk
+    on sentence boundaries.
+    """
+    enc = get_encoding()
+    step = max(1, max_tokens - overlap)
+    if enc is not None:
+        ids = enc.encode(text, disallowed_special=())
+        return [enc.decode(ids[i:i + max_tokens]) for i in range(0, max(len(ids) - overlap, 1), step)]
+    spans = [m.span() for m in _WORD_RE.finditer(text)]
+    return [
+        text[spans[i][0]:spans[min(i + max_tokens, len(spans)) - 1][1]]
+        for i in range(0, max(len(spans) - overlap, 1), step)
+    ] if spans else []
@@ -0,0 +1,291 @@
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from langchain_core.callbacks import BaseCallbackHandler
+from backend.tokens import count_tokens
+
+# Histogram buckets in seconds, from a BM25 lookup to a long generation
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# ---------- Prometheus metrics ----------
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names, values, extra=()) -> str:
+    pairs = list(zip(names, values)) + list(extra)
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in pairs) + "}" if pairs else ""
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels[n] for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                yield f"{self.name}{_labels(self.labelnames, key)} {value}"
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames=(), buckets=BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}   # label values -> [per-bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels[n] for n in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    yield f"{self.name}_bucket{_labels(self.labelnames, key, [('le', repr(bound))])} {cumulative}"
+                yield f"{self.name}_bucket{_labels(self.labelnames, key, [('le', '+Inf')])} {count}"
+                yield f"{self.name}_sum{_labels(self.labelnames, key)} {total}"
+                yield f"{self.name}_count{_labels(self.labelnames, key)} {count}"
+
+REQUESTS = Counter("rag_requests_total", "Traced RAG requests.", ["endpoint", "status"])
+REQUEST_SECONDS = Histogram("rag_request_seconds", "End-to-end request time, including streaming.", ["endpoint"])
+STAGE_SECONDS = Histogram("rag_stage_seconds", "Time spent per pipeline stage.", ["endpoint", "stage"])
+TTFT_SECONDS = Histogram("rag_ttft_seconds", "Time from request start to the first streamed LLM token.", ["endpoint"])
+LLM_TOKENS = Counter("rag_llm_tokens_total", "LLM tokens by kind (prompt or completion).", ["endpoint", "kind"])
+
+_METRICS = (REQUESTS, REQUEST_SECONDS, STAGE_SECONDS, TTFT_SECONDS, LLM_TOKENS)
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    return "\n".join(line for metric in _METRICS for line in metric.render()) + "\n"
+
+# ---------- Traces ----------
+class Trace:
+    """
+    Stage timings, LLM token counts and time-to-first-token of one
+    request. Stages are also observed into the Prometheus histograms as
+    they end; finish() records the request itself, once.
+    """
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.stages = {}          # stage -> seconds, summed over repeats
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.ttft = None
+        self.status = "ok"
+        self.finished = False
+        self._lock = threading.Lock()
+
+    def add_stage(self, stage: str, seconds: float):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        STAGE_SECONDS.observe(seconds, endpoint=self.endpoint, stage=stage)
+
+    def add_tokens(self, prompt: int, completion: int):
+        with self._lock:
+            self.prompt_tokens += prompt
+            self.completion_tokens += completion
+        LLM_TOKENS.inc(prompt, endpoint=self.endpoint, kind="prompt")
+        LLM_TOKENS.inc(completion, endpoint=self.endpoint, kind="completion")
+
+    def first_token(self):
+        with self._lock:
+            if self.ttft is not None:
+                return
+            self.ttft = time.perf_counter() - self.started
+        TTFT_SECONDS.observe(self.ttft, endpoint=self.endpoint)
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def finish(self):
+        with self._lock:
+            if self.finished:
+                return
+            self.finished = True
+        REQUEST_SECONDS.observe(self.elapsed(), endpoint=self.endpoint)
+        REQUESTS.inc(endpoint=self.endpoint, status=self.status)
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                "stages_ms": {stage: round(s * 1000, 2) for stage, s in self.stages.items()},
+                "ttft_ms": round(self.ttft * 1000, 2) if self.ttft is not None else None,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "elapsed_ms": round(self.elapsed() * 1000, 2),
+            }
+
+    def server_timing(self) -> str:
+        """Server-Timing header value for the stages finished so far."""
+        with self._lock:
+            entries = [f"{stage};dur={s * 1000:.2f}" for stage, s in self.stages.items()]
+            if self.prompt_tokens or self.completion_tokens:
+                entries.append(f'tokens;desc="prompt={self.prompt_tokens} completion={self.completion_tokens}"')
+            if self.ttft is not None:
+                entries.append(f"ttft;dur={self.ttft * 1000:.2f}")
+        entries.append(f"total;dur={self.elapsed() * 1000:.2f}")
+        return ", ".join(entries)
+
+# Survives run_in_threadpool (the context is copied) and the response's stream task
+_current = contextvars.ContextVar("rag_trace", default=None)
+
+def current_trace():
+    return _current.get()
+
+@contextmanager
+def traced(endpoint: str):
+    """
+    Runs the block under a trace: the request's when one is active (the
+    HTTP middleware started it, or an outer traced() call did), otherwise a
+    new one for `endpoint` that is finished when the block exits.
+    """
+    trace = _current.get()
+    if trace is not None:
+        yield trace
+        return
+    trace = Trace(endpoint)
+    token = _current.set(trace)
+    try:
+        yield trace
+    except BaseException:
+        trace.status = "error"
+        raise
+    finally:
+        _current.reset(token)
+        trace.finish()
+
+@contextmanager
+def span(stage: str):
+    """Times a stage of the current request (or of no request, as endpoint "none")."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        trace = _current.get()
+        if trace is not None:
+            trace.add_stage(stage, seconds)
+        else:
+            STAGE_SECONDS.observe(seconds, endpoint="none", stage=stage)
+
+# ---------- LangChain callbacks ----------
+class TraceCallback(BaseCallbackHandler):
+    """
+    Records LLM and retriever runs into a trace: the "llm" and "retrieve"
+    stages, token usage (the provider's counts when it reports them,
+    otherwise estimated with backend.tokens) and the first streamed token.
+    """
+
+    run_inline = True   # no executor hop for async runs
+
+    def __init__(self, trace: Trace):
+        self.trace = trace
+        self._runs = {}   # run id -> (start time, estimated prompt tokens)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        prompt = sum(count_tokens(str(m.content)) for batch in messages for m in batch)
+        self._runs[run_id] = (time.perf_counter(), prompt)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._runs[run_id] = (time.perf_counter(), sum(count_tokens(p) for p in prompts))
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        if token:
+            self.trace.first_token()
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        started, prompt = self._runs.pop(run_id, (None, 0))
+        if started is not None:
+            self.trace.add_stage("llm", time.perf_counter() - started)
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        prompt_tokens, completion_tokens = usage.get("prompt_tokens"), usage.get("completion_tokens")
+        if prompt_tokens is None:
+            generations = [g for batch in response.generations for g in batch]
+            metadata = [getattr(getattr(g, "message", None), "usage_metadata", None) for g in generations]
+            if metadata and all(metadata):
+                prompt_tokens = sum(m["input_tokens"] for m in metadata)
+                completion_tokens = sum(m["output_tokens"] for m in metadata)
+            else:
+                prompt_tokens = prompt
+                completion_tokens = sum(count_tokens(g.text) for g in generations)
+        self.trace.add_tokens(prompt_tokens, completion_tokens)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._runs.pop(run_id, None)
+
+    def on_retriever_start(self, serialized, query, *, run_id, **kwargs):
+        self._runs[run_id] = (time.perf_counter(), 0)
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        started, _ = self._runs.pop(run_id, (None, 0))
+        if started is not None:
+            self.trace.add_stage("retrieve", time.perf_counter() - started)
+
+def llm_config() -> dict:
+    """RunnableConfig that reports LLM/retriever runs to the current trace."""
+    trace = _current.get()
+    return {"callbacks": [TraceCallback(trace)]} if trace is not None else {}
+
+# ---------- ASGI ----------
+class TracingMiddleware:
+    """
+    Starts a trace for requests to the given paths ({path: endpoint name}),
+    adds a Server-Timing header with the stages finished before the
+    response starts, and finishes the trace when the last body chunk is
+    sent, so a streamed response is measured to its end.
+    """
+
+    def __init__(self, app, paths: dict):
+        self.app = app
+        self.paths = paths
+
+    async def __call__(self, scope, receive, send):
+        endpoint = self.paths.get(scope.get("path")) if scope["type"] == "http" else None
+        if endpoint is None:
+            await self.app(scope, receive, send)
+            return
+        trace = Trace(endpoint)
+        token = _current.set(trace)
+
+        async def send_traced(message):
+            if message["type"] == "http.response.start":
+                if message["status"] >= 400:
+                    trace.status = "error"
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", trace.server_timing().encode("latin-1")))
+                message = {**message, "headers": headers}
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                trace.finish()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_traced)
+        except BaseException:
+            trace.status = "error"
+            raise
+        finally:
+            _current.reset(token)
+            trace.finish()
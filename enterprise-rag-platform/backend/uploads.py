@@ -0,0 +1,152 @@
+import os
+import hashlib
+from collections import namedtuple
+from fastapi import HTTPException, Request
+from python_multipart import MultipartParser
+from python_multipart.exceptions import MultipartParseError
+from python_multipart.multipart import parse_options_header
+
+MAX_UPLOAD_MB = float(os.getenv("MAX_UPLOAD_MB", "200"))               # per uploaded file
+MAX_BATCH_UPLOAD_MB = float(os.getenv("MAX_BATCH_UPLOAD_MB", "2048"))   # whole /ingest_batch/ request
+MAX_UPLOAD_BYTES = int(MAX_UPLOAD_MB * 1024 * 1024)
+MAX_BATCH_UPLOAD_BYTES = int(MAX_BATCH_UPLOAD_MB * 1024 * 1024)
+MAX_FIELD_BYTES = 64 * 1024       # plain form fields (tags) are kept in memory
+FORM_OVERHEAD_BYTES = 1024 * 1024  # part headers and fields on top of a single file
+
+# path: where the file was spooled; digest: sha256 of its content (see manifest.file_hash)
+SpooledFile = namedtuple("SpooledFile", ["field", "filename", "path", "size", "digest"])
+
+def parse_tags(tags):
+    # Comma-separated form field; omitted keeps a document's existing tags
+    if tags is None:
+        return None
+    return [t.strip() for t in tags.split(",") if t.strip()]
+
+def unique_path(directory: str, filename: str) -> str:
+    base, ext = os.path.splitext(os.path.basename(filename))
+    path = os.path.join(directory, base + ext)
+    n = 1
+    while os.path.exists(path):
+        path = os.path.join(directory, f"{base}_{n}{ext}")
+        n += 1
+    return path
+
+def too_large(limit: int):
+    return HTTPException(status_code=413, detail=f"Upload exceeds {limit / (1024 * 1024):g} MB")
+
+class _FormWriter:
+    """
+    Callbacks for python-multipart's streaming parser: file parts go
+    straight to disk (hashed on the way), other fields into memory.
+    """
+
+    def __init__(self, directory: str, max_file_bytes: int):
+        self.directory = directory
+        self.max_file_bytes = max_file_bytes
+        self.files = []
+        self.fields = {}
+        self._headers = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._name = None
+        self._filename = None
+        self._out = None
+        self._hash = None
+        self._size = 0
+        self._value = bytearray()
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+        }
+
+    def on_part_begin(self):
+        self._headers = {}
+        self._name, self._filename = None, None
+        self._size = 0
+        self._value = bytearray()
+
+    def on_header_field(self, data, start, end):
+        self._header_field += data[start:end]
+
+    def on_header_value(self, data, start, end):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field, self._header_value = b"", b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        self._name = options.get(b"name", b"").decode("utf-8", "replace")
+        filename = options.get(b"filename")
+        if filename is not None:
+            # An empty filename is a file input with nothing selected
+            self._filename = filename.decode("utf-8", "replace")
+            if self._filename:
+                self._out = open(unique_path(self.directory, self._filename), "wb")
+                self._hash = hashlib.sha256()
+
+    def on_part_data(self, data, start, end):
+        self._size += end - start
+        if self._out is not None:
+            if self._size > self.max_file_bytes:
+                raise too_large(self.max_file_bytes)
+            chunk = data[start:end]
+            self._out.write(chunk)
+            self._hash.update(chunk)
+        elif self._filename is None:
+            if self._size > MAX_FIELD_BYTES:
+                raise HTTPException(status_code=413, detail=f"Form field {self._name!r} is too large")
+            self._value += data[start:end]
+
+    def on_part_end(self):
+        if self._out is not None:
+            self._out.close()
+            self.files.append(SpooledFile(self._name, self._filename, self._out.name,
+                                          self._size, self._hash.hexdigest()))
+            self._out = None
+        elif self._filename is None:
+            self.fields[self._name] = self._value.decode("utf-8", "replace")
+
+    def close(self):
+        if self._out is not None:
+            self._out.close()
+
+async def receive_form(request: Request, directory: str, max_file_bytes: int = MAX_UPLOAD_BYTES,
+                       max_body_bytes: int = MAX_UPLOAD_BYTES + FORM_OVERHEAD_BYTES):
+    """
+    Streams a multipart/form-data body into `directory` chunk by chunk and
+    returns ([SpooledFile], {field: value}). Size limits are checked as the
+    body arrives (and up front against Content-Length), so an oversized
+    upload is refused with 413 without being buffered. On error, files
+    already written are left for the caller to remove with `directory`.
+    """
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in options:
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data upload")
+    length = request.headers.get("content-length")
+    if length is not None and length.isdigit() and int(length) > max_body_bytes:
+        raise too_large(max_body_bytes)
+
+    writer = _FormWriter(directory, max_file_bytes)
+    parser = MultipartParser(options[b"boundary"], writer.callbacks())
+    received = 0
+    try:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > max_body_bytes:
+                raise too_large(max_body_bytes)
+            parser.write(chunk)
+        parser.finalize()
+    except MultipartParseError as e:
+        raise HTTPException(status_code=400, detail=f"Malformed multipart body: {e}")
+    finally:
+        writer.close()
+    return writer.files, writer.fields
@@ -0,0 +1,563 @@
+import os
+import json
+import math
+import shutil
+import logging
+import threading
+from array import array
+from contextlib import contextmanager
+from typing import List, Optional
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+logger = logging.getLogger(__name__)
+
+LOCAL_VECTOR_DIR = os.getenv("LOCAL_VECTOR_DIR", "vector_index")
+VECTOR_DTYPE = os.getenv("VECTOR_DTYPE", "int8")                 # int8 (+ per-vector scale) or float16
+IVF_MIN_ROWS = int(os.getenv("IVF_MIN_ROWS", "20000"))           # exact search below this many rows
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "8"))                   # inverted lists scanned per query
+VECTOR_COMPACTION_THRESHOLD = float(os.getenv("COMPACTION_THRESHOLD", "0.2"))
+SCAN_BLOCK_ROWS = 8192                                           # rows dequantized at a time
+CURRENT_FILE = "CURRENT"
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def _kmeans(data, n: int, iterations: int = 10, seed: int = 0):
+    """Spherical k-means on unit vectors; returns (n, dim) unit centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), n, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(data @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, data)
+        empty = np.bincount(assign, minlength=n) == 0
+        # Empty clusters restart from random points
+        sums[empty] = data[rng.choice(len(data), int(empty.sum()))]
+        centroids = _normalize(sums)
+    return centroids
+
+
+class _Generation:
+    """
+    One on-disk generation of the store. Rows are append-only; deletes are
+    tombstones until compaction writes the live rows to a new generation.
+
+    Files: vectors.bin (quantized rows), scales.bin (int8 only),
+    assign.bin (IVF list per row), records.jsonl (id, text, metadata) with
+    offsets.bin/lengths.bin locating each record, ids.jsonl (id, filename),
+    centroids.npy, and meta.json, whose row count is the commit point.
+    """
+
+    def __init__(self, path: str, dim: int, dtype: str):
+        self.path = path
+        self.dim = dim
+        self.dtype = dtype
+        self.count = 0
+        self.ids = []               # row -> id
+        self.rows = {}              # live id -> row
+        self.by_filename = {}       # filename -> rows (deleted ones are masked at search time)
+        self.offsets = array("q")   # row -> record start
+        self.lengths = array("I")   # row -> record length
+        self.assign = array("i")    # row -> IVF list, -1 before training
+        # (centroids, IVF list -> rows), None before training. Writers
+        # publish a new tuple instead of changing one, so a query that
+        # reads it once sees centroids and lists that belong together
+        self.ivf = None
+        self.trained_rows = 0
+        self.deleted = set()
+        self.deleted_rows = np.zeros(0, dtype=np.int64)
+        self.vectors = np.zeros((0, dim), dtype=dtype)
+        self.scales = np.zeros(0, dtype=np.float32)
+        self.records = None         # read handle for records.jsonl
+        self._readers = 0           # queries reading records (see LocalVectorStore._reading)
+        self._retired = False
+        self._state_lock = threading.Lock()
+
+    def file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def remap(self):
+        if self.count:
+            self.vectors = np.memmap(self.file("vectors.bin"), dtype=self.dtype, mode="r", shape=(self.count, self.dim))
+            if self.dtype == "int8":
+                self.scales = np.memmap(self.file("scales.bin"), dtype=np.float32, mode="r", shape=(self.count,))
+        if self.records is None and os.path.exists(self.file("records.jsonl")):
+            self.records = open(self.file("records.jsonl"), "rb")
+
+    def write_meta(self):
+        meta = {
+            "dim": self.dim,
+            "dtype": self.dtype,
+            "count": self.count,
+            "trained_rows": self.trained_rows,
+            "deleted": sorted(self.deleted),
+        }
+        tmp = self.file("meta.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, self.file("meta.json"))
+
+    def record(self, row: int) -> dict:
+        return json.loads(os.pread(self.records.fileno(), self.lengths[row], self.offsets[row]))
+
+    def acquire(self) -> bool:
+        """Registers a reader; False once the generation has been retired."""
+        with self._state_lock:
+            if self._retired:
+                return False
+            self._readers += 1
+            return True
+
+    def release(self):
+        with self._state_lock:
+            self._readers -= 1
+            last = self._retired and not self._readers
+        if last:
+            self._close()
+
+    def retire(self):
+        """Closes and removes the generation once its last reader is done."""
+        with self._state_lock:
+            self._retired = True
+            idle = not self._readers
+        if idle:
+            self._close()
+
+    def _close(self):
+        if self.records is not None:
+            self.records.close()
+            self.records = None
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    @classmethod
+    def load(cls, path: str):
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        gen = cls(path, meta["dim"], meta["dtype"])
+        n = gen.count = meta["count"]
+        gen.trained_rows = meta["trained_rows"]
+        # Rows past the committed count belong to a write that never finished
+        gen.offsets = array("q", np.fromfile(gen.file("offsets.bin"), dtype=np.int64, count=n).tolist())
+        gen.lengths = array("I", np.fromfile(gen.file("lengths.bin"), dtype=np.uint32, count=n).tolist())
+        gen.assign = array("i", np.fromfile(gen.file("assign.bin"), dtype=np.int32, count=n).tolist())
+        row_size = gen.dim * np.dtype(gen.dtype).itemsize
+        sizes = {"vectors.bin": n * row_size, "offsets.bin": n * 8, "lengths.bin": n * 4, "assign.bin": n * 4,
+                 "records.jsonl": (gen.offsets[-1] + gen.lengths[-1]) if n else 0}
+        if gen.dtype == "int8":
+            sizes["scales.bin"] = n * 4
+        for name, size in sizes.items():
+            if os.path.getsize(gen.file(name)) > size:
+                with open(gen.file(name), "r+b") as f:
+                    f.truncate(size)
+        centroids = lists = None
+        if os.path.exists(gen.file("centroids.npy")):
+            centroids = np.load(gen.file("centroids.npy"))
+            if not gen.trained_rows or (n and max(gen.assign) >= len(centroids)):
+                # Training was interrupted; the next write retrains
+                centroids, gen.trained_rows = None, 0
+                gen.assign = array("i", [-1] * n)
+            else:
+                lists = [array("I") for _ in range(len(centroids))]
+        with open(gen.file("ids.jsonl"), "r+b") as f:
+            for row in range(n):
+                id_, filename = json.loads(f.readline())
+                gen.ids.append(id_)
+                gen.rows[id_] = row
+                gen.by_filename.setdefault(filename, []).append(row)
+                if gen.assign[row] >= 0:
+                    lists[gen.assign[row]].append(row)
+            f.truncate(f.tell())
+        if centroids is not None:
+            gen.ivf = (centroids, lists)
+        gen.deleted = set(meta["deleted"])
+        for row in gen.deleted:
+            gen.rows.pop(gen.ids[row], None)
+        gen.deleted_rows = np.array(sorted(gen.deleted), dtype=np.int64)
+        gen.remap()
+        return gen
+
+
+class LocalVectorStore(VectorStore):
+    """
+    In-process vector store backed by memory-mapped files.
+
+    Embeddings are L2-normalized and stored as int8 with one float32 scale
+    per row (about a quarter of float32), or as float16. Below
+    IVF_MIN_ROWS a query scans every row; above it the rows are clustered
+    with k-means into an IVF index and a query scans only the IVF_NPROBE
+    closest lists. The index is retrained when the store has doubled
+    since the last training.
+
+    Scores are cosine distances (1 - cosine similarity), like Chroma's, so
+    smaller is closer. Filters restrict the candidate rows before scoring
+    and support {"chunk_id" | "id" | "filename": value or {"$in": [...]}}.
+    """
+
+    def __init__(self, embedding: Embeddings, path: str = LOCAL_VECTOR_DIR, dtype: str = VECTOR_DTYPE,
+                 nprobe: int = IVF_NPROBE, ivf_min_rows: int = IVF_MIN_ROWS):
+        if dtype not in ("int8", "float16"):
+            raise ValueError(f"Unsupported vector dtype: {dtype}")
+        self.embedding = embedding
+        self.path = path
+        self.dtype = dtype
+        self.nprobe = nprobe
+        self.ivf_min_rows = ivf_min_rows
+        self._lock = threading.Lock()   # serializes writers
+        self._compacting = threading.Event()
+        self._generation_number = 0
+        self._gen = None
+        current = os.path.join(path, CURRENT_FILE)
+        if os.path.exists(current):
+            with open(current) as f:
+                self._generation_number = int(f.read().strip())
+            self._gen = _Generation.load(self._generation_path(self._generation_number))
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding
+
+    def _generation_path(self, number: int) -> str:
+        return os.path.join(self.path, f"gen-{number:06d}")
+
+    def _new_generation(self, dim: int) -> _Generation:
+        self._generation_number += 1
+        path = self._generation_path(self._generation_number)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.makedirs(path)
+        for name in ("vectors.bin", "scales.bin", "offsets.bin", "lengths.bin", "assign.bin", "records.jsonl", "ids.jsonl"):
+            open(os.path.join(path, name), "wb").close()
+        return _Generation(path, dim, self.dtype)
+
+    def _publish(self, gen: _Generation):
+        """Makes gen the generation loaded at startup."""
+        tmp = os.path.join(self.path, CURRENT_FILE + ".tmp")
+        with open(tmp, "w") as f:
+            f.write(str(self._generation_number))
+        os.replace(tmp, os.path.join(self.path, CURRENT_FILE))
+        old, self._gen = self._gen, gen
+        if old is not None and old.path != gen.path:
+            # Queries still reading the old generation finish first
+            old.retire()
+
+    @contextmanager
+    def _reading(self):
+        """Yields the current generation (or None), kept open until the block exits."""
+        while True:
+            gen = self._gen
+            if gen is None:
+                yield None
+                return
+            if gen.acquire():
+                break
+            # Retired after we read self._gen; its successor is already published
+        try:
+            yield gen
+        finally:
+            gen.release()
+
+    # ---------- Writes ----------
+    def _quantize(self, vectors):
+        if self.dtype == "int8":
+            scales = np.abs(vectors).max(axis=1) / 127
+            scales[scales == 0] = 1
+            return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+        return vectors.astype(np.float16), None
+
+    def _append(self, gen: _Generation, ids, texts, metadatas, vectors):
+        quantized, scales = self._quantize(vectors)
+        ivf = gen.ivf
+        assign = np.full(len(ids), -1, dtype=np.int32)
+        if ivf is not None:
+            assign = np.argmax(vectors @ ivf[0].T, axis=1).astype(np.int32)
+
+        records = [json.dumps({"id": i, "text": t, "metadata": m}).encode("utf-8") + b"\n"
+                   for i, t, m in zip(ids, texts, metadatas)]
+        start = os.path.getsize(gen.file("records.jsonl"))
+        lengths = np.array([len(r) for r in records], dtype=np.uint32)
+        offsets = start + np.concatenate([[0], np.cumsum(lengths[:-1], dtype=np.int64)]).astype(np.int64)
+        with open(gen.file("vectors.bin"), "ab") as f:
+            f.write(quantized.tobytes())
+        if scales is not None:
+            with open(gen.file("scales.bin"), "ab") as f:
+                f.write(scales.tobytes())
+        with open(gen.file("records.jsonl"), "ab") as f:
+            f.write(b"".join(records))
+        with open(gen.file("offsets.bin"), "ab") as f:
+            f.write(offsets.tobytes())
+        with open(gen.file("lengths.bin"), "ab") as f:
+            f.write(lengths.tobytes())
+        with open(gen.file("assign.bin"), "ab") as f:
+            f.write(assign.tobytes())
+        with open(gen.file("ids.jsonl"), "a") as f:
+            f.writelines(json.dumps([i, m.get("filename")]) + "\n" for i, m in zip(ids, metadatas))
+
+        first = gen.count
+        for n, (id_, meta) in enumerate(zip(ids, metadatas)):
+            row = first + n
+            gen.ids.append(id_)
+            gen.rows[id_] = row
+            gen.by_filename.setdefault(meta.get("filename"), []).append(row)
+        gen.offsets.extend(offsets.tolist())
+        gen.lengths.extend(lengths.tolist())
+        gen.assign.extend(assign.tolist())
+        gen.count += len(ids)
+        if ivf is not None:
+            # Copy the lists that grow; queries may be reading the old ones
+            centroids, lists = ivf[0], list(ivf[1])
+            rows = np.arange(first, first + len(ids), dtype=np.uint32)
+            for c in np.unique(assign):
+                lists[c] = lists[c] + array("I", rows[assign == c].tobytes())
+            gen.ivf = (centroids, lists)
+
+    def _delete_rows(self, gen: _Generation, ids) -> bool:
+        changed = False
+        for id_ in ids:
+            row = gen.rows.pop(id_, None)
+            if row is not None:
+                gen.deleted.add(row)
+                changed = True
+        if changed:
+            gen.deleted_rows = np.array(sorted(gen.deleted), dtype=np.int64)
+        return changed
+
+    def add_texts(self, texts, metadatas: Optional[List[dict]] = None, ids: Optional[List[str]] = None, **kwargs):
+        """Adds texts; an existing id is replaced (upsert)."""
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = list(metadatas) if metadatas is not None else [{} for _ in texts]
+        if ids is None:
+            import uuid
+            ids = [uuid.uuid4().hex for _ in texts]
+        ids = list(ids)
+        # Local backends hand back one array instead of a list per text
+        embed = getattr(self.embedding, "embed_matrix", self.embedding.embed_documents)
+        vectors = _normalize(embed(texts))
+        with self._lock:
+            gen = self._gen
+            if gen is None:
+                os.makedirs(self.path, exist_ok=True)
+                gen = self._new_generation(vectors.shape[1])
+            elif vectors.shape[1] != gen.dim:
+                raise ValueError(f"Embedding size {vectors.shape[1]} does not match the store ({gen.dim})")
+            self._delete_rows(gen, ids)
+            self._append(gen, ids, texts, metadatas, vectors)
+            self._maybe_train(gen)
+            gen.write_meta()
+            gen.remap()
+            if gen is not self._gen:
+                self._publish(gen)
+        return ids
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs):
+        """Tombstones ids; compacts in the background past the threshold."""
+        if not ids:
+            return
+        with self._lock:
+            gen = self._gen
+            if gen is None or not self._delete_rows(gen, ids):
+                return
+            gen.write_meta()
+            if len(gen.deleted) >= VECTOR_COMPACTION_THRESHOLD * gen.count:
+                self.schedule_compaction()
+
+    def persist(self):
+        """Writes are committed as they happen; kept for Chroma compatibility."""
+
+    # ---------- IVF ----------
+    def _maybe_train(self, gen: _Generation):
+        live = gen.count - len(gen.deleted)
+        if live < self.ivf_min_rows or (gen.ivf is not None and gen.count < 2 * gen.trained_rows):
+            return
+        nlist = max(16, int(2 * math.sqrt(live)))
+        rng = np.random.default_rng(gen.count)
+        sample = np.sort(rng.choice(gen.count, min(gen.count, 64 * nlist), replace=False))
+        # A low IVF_MIN_ROWS can leave fewer rows than lists; k-means seeds from distinct rows
+        nlist = min(nlist, len(sample))
+        vectors = np.memmap(gen.file("vectors.bin"), dtype=gen.dtype, mode="r", shape=(gen.count, gen.dim))
+        scales = np.memmap(gen.file("scales.bin"), dtype=np.float32, mode="r", shape=(gen.count,)) \
+            if gen.dtype == "int8" else None
+        centroids = _kmeans(_normalize(self._dequantize(vectors, scales, sample)), nlist)
+
+        assign = np.empty(gen.count, dtype=np.int32)
+        for lo in range(0, gen.count, SCAN_BLOCK_ROWS):
+            rows = np.arange(lo, min(lo + SCAN_BLOCK_ROWS, gen.count))
+            assign[rows] = np.argmax(self._dequantize(vectors, scales, rows) @ centroids.T, axis=1)
+        np.save(gen.file("centroids.npy"), centroids)
+        tmp = gen.file("assign.bin.tmp")
+        assign.tofile(tmp)
+        os.replace(tmp, gen.file("assign.bin"))
+
+        lists = [array("I") for _ in range(nlist)]
+        order = np.argsort(assign, kind="stable")
+        bounds = np.searchsorted(assign[order], np.arange(nlist + 1))
+        for c in range(nlist):
+            lists[c].extend(order[bounds[c]:bounds[c + 1]].tolist())
+        gen.assign = array("i", assign.tolist())
+        gen.ivf = (centroids, lists)
+        gen.trained_rows = gen.count
+        logger.info("Trained IVF index: %d lists over %d rows", nlist, gen.count)
+
+    # ---------- Search ----------
+    @staticmethod
+    def _dequantize(vectors, scales, rows):
+        block = np.asarray(vectors[rows], dtype=np.float32)
+        if scales is not None:
+            block *= np.asarray(scales[rows])[:, None]
+        return block
+
+    def _filter_rows(self, gen: _Generation, where: dict):
+        rows = None
+        for key, condition in where.items():
+            values = condition["$in"] if isinstance(condition, dict) and "$in" in condition else [condition]
+            if key in ("chunk_id", "id"):
+                # get() alone: a delete may drop the id between a check and a lookup
+                matched = {row for row in map(gen.rows.get, values) if row is not None}
+            elif key == "filename":
+                matched = {r for v in values for r in gen.by_filename.get(v, ())}
+            else:
+                raise ValueError(f"Unsupported filter field: {key}")
+            rows = matched if rows is None else rows & matched
+        return np.array(sorted(rows), dtype=np.int64)
+
+    def search_vector(self, query, k: int, filter: Optional[dict] = None, gen: _Generation = None):
+        """Returns [(row, cosine similarity)], best first, from `gen` (default: the current generation)."""
+        gen = gen or self._gen
+        if gen is None:
+            return gen, []
+        vectors, scales = gen.vectors, (gen.scales if gen.dtype == "int8" else None)
+        # remap() replaces the two maps one after the other
+        n = len(vectors) if scales is None else min(len(vectors), len(scales))
+        ivf = gen.ivf
+        query = _normalize(query)
+
+        if filter:
+            candidates = self._filter_rows(gen, filter)
+        elif ivf is not None:
+            centroids, lists = ivf
+            probe = np.argsort(-(centroids @ query))[:self.nprobe]
+            candidates = np.sort(np.concatenate(
+                [np.frombuffer(lists[c], dtype=np.uint32) for c in probe] + [np.zeros(0, dtype=np.uint32)]
+            ).astype(np.int64))
+            # Lists may already hold rows appended after this read began
+            candidates = candidates[candidates < n]
+        else:
+            candidates = None
+        if len(gen.deleted_rows):
+            if candidates is None:
+                candidates = np.arange(n)
+            candidates = candidates[~np.isin(candidates, gen.deleted_rows)]
+
+        if candidates is None:
+            scores = np.empty(n, dtype=np.float32)
+            for lo in range(0, n, SCAN_BLOCK_ROWS):
+                rows = slice(lo, min(lo + SCAN_BLOCK_ROWS, n))
+                scores[rows] = self._dequantize(vectors, scales, rows) @ query
+            rows = np.arange(n)
+        else:
+            candidates = candidates[candidates < n]
+            scores = np.empty(len(candidates), dtype=np.float32)
+            for lo in range(0, len(candidates), SCAN_BLOCK_ROWS):
+                block = candidates[lo:lo + SCAN_BLOCK_ROWS]
+                scores[lo:lo + len(block)] = self._dequantize(vectors, scales, block) @ query
+            rows = candidates
+        if len(scores) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return gen, [(int(rows[i]), float(scores[i])) for i in top]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, filter: Optional[dict] = None, **kwargs):
+        vector = self.embedding.embed_query(query)
+        results = []
+        with self._reading() as gen:
+            if gen is None:
+                return results
+            _, hits = self.search_vector(vector, k, filter, gen)
+            for row, similarity in hits:
+                record = gen.record(row)
+                results.append((Document(page_content=record["text"], metadata=record["metadata"]), 1.0 - similarity))
+        return results
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[dict] = None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def get_by_ids(self, ids, /):
+        docs = []
+        with self._reading() as gen:
+            if gen is None:
+                return docs
+            for id_ in dict.fromkeys(ids):
+                row = gen.rows.get(id_)
+                if row is not None:
+                    record = gen.record(row)
+                    docs.append(Document(id=id_, page_content=record["text"], metadata=record["metadata"]))
+        return docs
+
+    @classmethod
+    def from_texts(cls, texts, embedding: Embeddings, metadatas=None, ids=None, **kwargs):
+        store = cls(embedding, **kwargs)
+        store.add_texts(texts, metadatas, ids)
+        return store
+
+    # ---------- Compaction ----------
+    def schedule_compaction(self) -> bool:
+        if self._compacting.is_set():
+            return False
+        self._compacting.set()
+        threading.Thread(target=self.compact, name="vector-compaction", daemon=True).start()
+        return True
+
+    def compact(self):
+        """
+        Rewrites the live rows into a new generation (retraining the IVF
+        index if it is large enough) and switches to it. Queries keep
+        reading the old generation meanwhile; writers wait.
+        """
+        self._compacting.set()
+        try:
+            with self._lock:
+                gen = self._gen
+                if gen is None or not gen.deleted:
+                    return
+                live = np.setdiff1d(np.arange(gen.count), gen.deleted_rows)
+                new = self._new_generation(gen.dim)
+                scales = gen.scales if gen.dtype == "int8" else None
+                for lo in range(0, len(live), SCAN_BLOCK_ROWS):
+                    rows = live[lo:lo + SCAN_BLOCK_ROWS]
+                    records = [gen.record(int(r)) for r in rows]
+                    self._append(new, [r["id"] for r in records], [r["text"] for r in records],
+                                 [r["metadata"] for r in records], _normalize(self._dequantize(gen.vectors, scales, rows)))
+                self._maybe_train(new)
+                new.write_meta()
+                new.remap()
+                self._publish(new)
+            logger.info("Vector store compaction dropped %d rows, %d remain", gen.count - new.count, new.count)
+        except Exception:
+            logger.exception("Vector store compaction failed")
+        finally:
+            self._compacting.clear()
+
+    def stats(self) -> dict:
+        gen = self._gen
+        ivf = gen.ivf if gen is not None else None
+        if gen is None:
+            return {"rows": 0, "deleted": 0, "dtype": self.dtype, "ivf_lists": 0, "compacting": self._compacting.is_set()}
+        return {
+            "rows": gen.count,
+            "deleted": len(gen.deleted),
+            "dim": gen.dim,
+            "dtype": gen.dtype,
+            "ivf_lists": len(ivf[1]) if ivf is not None else 0,
+            "vector_bytes": int(gen.vectors.nbytes + gen.scales.nbytes),
+            "compacting": self._compacting.is_set(),
+        }
@@ -0,0 +1,273 @@
+"""
+Offline RAG benchmark.
+
+Generates a synthetic corpus with planted facts, ingests it with the real
+ingestion/indexing code and queries it through query_hybrid, query_docs
+and stream_sse_with_memory. Embeddings come from the local hashing backend
+and the chat model is a deterministic stand-in, so no API key or network
+is needed and runs are comparable between commits.
+
+Reports ingest docs/sec, latency percentiles per retrieval mode, memory
+footprint and recall@k of the planted answers.
+
+    python benchmarks/rag_benchmark.py --docs 200 1000 --queries 100
+    python benchmarks/rag_benchmark.py --docs 500 --json results.json
+
+Every corpus size runs in its own subprocess and temporary directory,
+because the backend keeps its indexes in module state.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import resource
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODES = {
+    "dense": {"fusion": "rrf", "dense_weight": 1.0, "sparse_weight": 0.0},
+    "sparse": {"fusion": "rrf", "dense_weight": 0.0, "sparse_weight": 1.0},
+    "rrf": {"fusion": "rrf", "dense_weight": 1.0, "sparse_weight": 1.0},
+    "score": {"fusion": "score", "dense_weight": 1.0, "sparse_weight": 1.0},
+}
+
+# ---------- Stand-ins ----------
+def make_llm():
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+    return FakeListChatModel(responses=["This is a synthetic answer produced by the benchmark stand-in model."])
+
+# ---------- Corpus ----------
+# (planted sentence, question) pairs. Each fact gets its own made-up
+# subject, so a question shares at most one relation word with the other
+# planted facts and recall measures retrieval, not the template.
+FACTS = (
+    ("{s} unlocks with access code {v}.", "Which access code unlocks {s}?"),
+    ("Budget approved for {s}: {v} dollars.", "How many dollars were approved for {s}?"),
+    ("{s} launched during week {v}.", "During which week was {s} launched?"),
+    ("{s} headquarters occupies building {v}.", "Which building houses {s} headquarters?"),
+    ("Ticket {v} tracks {s} outages.", "What ticket tracks outages of {s}?"),
+    ("{s} owner carries badge {v}.", "Which badge does the {s} owner carry?"),
+    ("Server rack {v} hosts {s}.", "Which server rack hosts {s}?"),
+    ("{s} retention spans {v} days.", "How many days does {s} retention span?"),
+)
+SYLLABLES = ("ka", "vor", "lin", "dra", "mek", "sul", "tho", "rix", "pal", "zen", "qua", "bor", "fel", "yon", "gri")
+
+def make_corpus(num_docs: int, paragraphs: int, num_queries: int, seed: int):
+    """
+    Returns ([(filename, text)], [(question, filename)]). Each query asks
+    for a fact planted in exactly one document.
+    """
+    rng = random.Random(seed)
+    vocabulary = ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(3, 9)))
+                  for _ in range(5000)]
+    docs = []
+    for i in range(num_docs):
+        paras = []
+        for _ in range(paragraphs):
+            sentences = [" ".join(rng.choices(vocabulary, k=rng.randint(8, 20))).capitalize() + "."
+                         for _ in range(rng.randint(3, 6))]
+            paras.append(" ".join(sentences))
+        docs.append([f"doc_{i:06d}.txt", paras])
+
+    # Subject words never occur in the filler or in another fact
+    used = set(vocabulary)
+
+    def fresh_word():
+        while True:
+            word = "".join(rng.choices(SYLLABLES, k=rng.randint(3, 4)))
+            if word not in used:
+                used.add(word)
+                return word.capitalize()
+
+    queries = []
+    for q, doc_index in enumerate(rng.sample(range(num_docs), min(num_queries, num_docs))):
+        subject, value = f"{fresh_word()} {fresh_word()}", f"{rng.randint(100000, 999999)}"
+        fact, question = FACTS[q % len(FACTS)]
+        filename, paras = docs[doc_index]
+        paras.insert(rng.randrange(len(paras) + 1), fact.format(s=subject, v=value))
+        queries.append((question.format(s=subject), filename))
+    return [(name, "\n\n".join(paras)) for name, paras in docs], queries
+
+# ---------- Measurement ----------
+def percentiles(samples):
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def pick(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+    return {
+        "p50_ms": round(pick(50) * 1000, 2),
+        "p95_ms": round(pick(95) * 1000, 2),
+        "p99_ms": round(pick(99) * 1000, 2),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 2),
+    }
+
+def rss_mb() -> float:
+    # Linux reports KiB, macOS bytes
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def dir_mb(path: str) -> float:
+    total = 0
+    for base, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(base, f)) for f in files)
+    return round(total / (1024 * 1024), 2)
+
+def run_single(args) -> dict:
+    """Runs one corpus size in a scratch directory that is removed afterwards."""
+    cwd = os.getcwd()
+    # The stores may still hold files open, which Windows won't delete
+    with tempfile.TemporaryDirectory(prefix="rag-bench-", ignore_cleanup_errors=True) as workdir:
+        os.chdir(workdir)
+        try:
+            return _measure(args)
+        finally:
+            os.chdir(cwd)
+
+def _measure(args) -> dict:
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    os.environ["EMBEDDING_BACKEND"] = "hashing"
+    os.environ["HASHING_EMBEDDING_DIM"] = str(args.dim)
+    os.environ["ANSWER_CACHE_SIZE"] = os.environ.get("ANSWER_CACHE_SIZE", "1024" if args.answer_cache else "0")
+    sys.path.insert(0, ROOT)
+
+    from backend import resources
+
+    resources._resources["llm"] = make_llm()
+
+    from backend.ingestion import ingest_document
+    from backend.hybrid_retriever import retrieve_hybrid, query_hybrid
+    from backend.retriever import query_docs
+    from backend.streaming import stream_sse_with_memory
+    from backend import vector_store
+
+    num_docs = args.docs[0]
+    corpus, queries = make_corpus(num_docs, args.paragraphs, args.queries, args.seed)
+    rss_before = rss_mb()
+
+    # Ingest
+    chunks = 0
+    started = time.perf_counter()
+    for filename, text in corpus:
+        chunks += ingest_document(text.encode("utf-8"), filename)["chunks"]
+    ingest_seconds = time.perf_counter() - started
+
+    report = {
+        "docs": num_docs,
+        "chunks": chunks,
+        "ingest": {
+            "seconds": round(ingest_seconds, 2),
+            "docs_per_sec": round(num_docs / ingest_seconds, 1),
+            "chunks_per_sec": round(chunks / ingest_seconds, 1),
+        },
+        "retrieval": {},
+        "recall_at_k": {},
+    }
+
+    # Retrieval modes: latency and recall@k of the planted document
+    for mode, options in MODES.items():
+        latencies, found = [], 0
+        for question, filename in queries:
+            t = time.perf_counter()
+            sources = retrieve_hybrid(question, k=args.k, **options)
+            latencies.append(time.perf_counter() - t)
+            found += any(s["filename"] == filename for s in sources)
+        report["retrieval"][mode] = percentiles(latencies)
+        report["recall_at_k"][mode] = round(found / len(queries), 3) if queries else None
+
+    # End-to-end paths with the stand-in model
+    latencies = []
+    for question, _ in queries:
+        t = time.perf_counter()
+        query_hybrid(question, k=args.k)
+        latencies.append(time.perf_counter() - t)
+    report["query_hybrid"] = percentiles(latencies)
+
+    latencies = []
+    for question, _ in queries:
+        t = time.perf_counter()
+        query_docs(question)
+        latencies.append(time.perf_counter() - t)
+    report["query_docs"] = percentiles(latencies)
+
+    async def stream_all():
+        ttft, totals = [], []
+        for i, (question, _) in enumerate(queries):
+            t = time.perf_counter()
+            response = await stream_sse_with_memory(f"bench-{i % 8}", question, k=args.k)
+            first = None
+            async for event in response.body_iterator:
+                if first is None and '"token"' in event:
+                    first = time.perf_counter() - t
+            ttft.append(first if first is not None else time.perf_counter() - t)
+            totals.append(time.perf_counter() - t)
+        return ttft, totals
+
+    ttft, totals = asyncio.run(stream_all())
+    report["stream_sse_with_memory"] = {"ttft": percentiles(ttft), "total": percentiles(totals)}
+
+    report["memory"] = {
+        "peak_rss_mb": rss_mb(),
+        "rss_growth_mb": round(rss_mb() - rss_before, 1),
+        "sparse_index_mb": dir_mb("sparse_index"),
+        "vector_store_mb": dir_mb(resources.VECTOR_STORE_DIR) + dir_mb(vector_store.LOCAL_VECTOR_DIR),
+    }
+    return report
+
+def print_report(report: dict):
+    print(f"\n== {report['docs']} docs / {report['chunks']} chunks ==")
+    ingest = report["ingest"]
+    print(f"ingest: {ingest['docs_per_sec']} docs/s, {ingest['chunks_per_sec']} chunks/s ({ingest['seconds']}s)")
+    print(f"{'path':<28}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'recall@k':>10}")
+    for mode, stats in report["retrieval"].items():
+        print(f"{'retrieve/' + mode:<28}{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}"
+              f"{report['recall_at_k'][mode]:>10}")
+    rows = [("query_hybrid", report["query_hybrid"]), ("query_docs", report["query_docs"]),
+            ("sse ttft", report["stream_sse_with_memory"]["ttft"]),
+            ("sse total", report["stream_sse_with_memory"]["total"])]
+    for name, stats in rows:
+        print(f"{name:<28}{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}")
+    memory = report["memory"]
+    print(f"memory: peak rss {memory['peak_rss_mb']} MB (+{memory['rss_growth_mb']} MB), "
+          f"sparse index {memory['sparse_index_mb']} MB, vector store {memory['vector_store_mb']} MB")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--docs", type=int, nargs="+", default=[200], help="corpus sizes to run")
+    parser.add_argument("--paragraphs", type=int, default=6, help="paragraphs per document")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--dim", type=int, default=1024, help="hashing embedding size")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--answer-cache", action="store_true", help="leave the answer cache on")
+    parser.add_argument("--json", help="also write the reports to this file")
+    parser.add_argument("--single", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        print(json.dumps(run_single(args)))
+        return
+
+    reports = []
+    for size in args.docs:
+        cmd = [sys.executable, os.path.abspath(__file__), "--single", "--docs", str(size),
+               "--paragraphs", str(args.paragraphs), "--queries", str(args.queries), "--k", str(args.k),
+               "--dim", str(args.dim), "--seed", str(args.seed)] + (["--answer-cache"] if args.answer_cache else [])
+        out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+        report = json.loads(out.strip().splitlines()[-1])
+        reports.append(report)
+        print_report(report)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(reports, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -4,11 +4,13 @@ import requests
 import uuid
 import json
 import os
+import time
 from dotenv import load_dotenv
 
 # ---------- CONFIG ----------
 load_dotenv()
 BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8000")
+RENDER_FPS = float(os.getenv("RENDER_FPS", "10"))  # max answer redraws per second while streaming
 # ----------------------------
 
 st.set_page_config(page_title="Enterprise RAG (Streamlit)", layout="wide")
@@ -50,6 +52,70 @@ def sse_stream_post(url, json_data=None, timeout=60):
                         yield {"type": "raw", "value": payload}
 
 
+ASSISTANT_HTML = "<div style='text-align:left; background:#e0e0e0; color:#111; padding:12px; border-radius:12px;'><b>Assistant:</b> {}</div>"
+
+
+class ThrottledAnswer:
+    """
+    Collects streamed tokens and redraws the answer placeholder at most
+    `fps` times per second. Each redraw only joins the tokens that arrived
+    since the previous one onto the running text, so a long answer costs
+    a bounded number of redraws instead of one full re-render per token.
+    """
+
+    def __init__(self, placeholder, fps=RENDER_FPS):
+        self.placeholder = placeholder
+        self.interval = 1.0 / fps if fps > 0 else 0.0
+        self.text = ""
+        self.pending = []
+        self.tokens = 0
+        self.frames = 0
+        self.render_seconds = 0.0
+        self.started = time.perf_counter()
+        self.last_draw = 0.0
+
+    def append(self, token):
+        self.pending.append(token)
+        self.tokens += 1
+        if time.perf_counter() - self.last_draw >= self.interval:
+            self.draw()
+
+    def draw(self):
+        if self.pending:
+            self.text += "".join(self.pending)
+            self.pending = []
+        t = time.perf_counter()
+        self.placeholder.markdown(ASSISTANT_HTML.format(self.text), unsafe_allow_html=True)
+        self.last_draw = time.perf_counter()
+        self.render_seconds += self.last_draw - t
+        self.frames += 1
+
+    def finish(self):
+        """Draws whatever is left and returns the answer's render metrics."""
+        self.text = (self.text + "".join(self.pending)).strip()
+        self.pending = []
+        self.draw()
+        return {
+            "tokens": self.tokens,
+            "frames": self.frames,
+            "render_ms": round(self.render_seconds * 1000, 1),
+            "stream_ms": round((time.perf_counter() - self.started) * 1000, 1),
+        }
+
+
+def render_diagnostics(target):
+    with target.container():
+        st.markdown("### Diagnostics")
+        st.write(f"Messages: {len(st.session_state.messages)}")
+        st.write(f"Sources cached: {len(st.session_state.sources)}")
+        stats = st.session_state.render_stats
+        if stats:
+            st.write(
+                f"Last answer render: {stats['render_ms']} ms in {stats['frames']} frames "
+                f"for {stats['tokens']} tokens ({stats['stream_ms']} ms streaming)"
+            )
+
+
 # --- Session state ---
 if "session_id" not in st.session_state:
     st.session_state.session_id = str(uuid.uuid4())
@@ -61,6 +127,8 @@ if "last_assistant" not in st.session_state:
     st.session_state.last_assistant = None
 if "is_streaming" not in st.session_state:
     st.session_state.is_streaming = False
+if "render_stats" not in st.session_state:
+    st.session_state.render_stats = None
 
 
 # --- Layout: left pane upload + controls, right pane chat display ---
@@ -85,29 +153,30 @@ with col_left:
 
     st.markdown("---")
     st.header("Controls")
-if st.button("Reset Conversation (clear memory)"):
-    try:
-        resp = requests.post(
-            f"{BACKEND_URL}/reset_memory/?session_id={st.session_state.session_id}",
-            timeout=10
-        )
-        resp.raise_for_status()
-        # Clear session state
-        st.session_state.messages = []
-        st.session_state.sources = []
-        st.session_state.last_assistant = None
-        st.session_state.session_id = str(uuid.uuid4())
-        st.success("Conversation history cleared.")
-        
-        # Force rerun by modifying a dummy session_state key
-        st.session_state._rerun = st.session_state.get("_rerun", 0) + 1
+    if st.button("Reset Conversation (clear memory)"):
+        try:
+            resp = requests.post(
+                f"{BACKEND_URL}/reset_memory/?session_id={st.session_state.session_id}",
+                timeout=10
+            )
+            resp.raise_for_status()
+            # Clear session state
+            st.session_state.messages = []
+            st.session_state.sources = []
+            st.session_state.last_assistant = None
+            st.session_state.render_stats = None
+            st.session_state.session_id = str(uuid.uuid4())
+            st.success("Conversation history cleared.")
 
-    except Exception as e:
-        st.error(f"Reset failed: {e}")
+            # Force rerun by modifying a dummy session_state key
+            st.session_state._rerun = st.session_state.get("_rerun", 0) + 1
+
+        except Exception as e:
+            st.error(f"Reset failed: {e}")
 
-    st.markdown("### Diagnostics")
-    st.write(f"Messages: {len(st.session_state.messages)}")
-    st.write(f"Sources cached: {len(st.session_state.sources)}")
+    # Redrawn once an answer finishes streaming, so its render time shows right away
+    diagnostics_placeholder = st.empty()
+    render_diagnostics(diagnostics_placeholder)
 
 with col_right:
     st.title("RAG Chat")
@@ -119,7 +188,7 @@ with col_right:
             if m["role"] == "user":
                 st.markdown(f"<div style='text-align:right'><b>You:</b> {m['content']}</div>", unsafe_allow_html=True)
             else:
-                st.markdown(f"<div style='text-align:left; background:#e0e0e0; color:#111; padding:12px; border-radius:12px;'><b>Assistant:</b> {m['content']}</div>", unsafe_allow_html=True)
+                st.markdown(ASSISTANT_HTML.format(m["content"]), unsafe_allow_html=True)
 
         if st.session_state.is_streaming:
             st.info("Assistant is typing...")
@@ -147,7 +216,7 @@ with col_right:
 
         assistant_placeholder = st.empty()
         source_placeholder = st.empty()
-        final_answer_parts = []
+        answer = ThrottledAnswer(assistant_placeholder)
 
         try:
             url = f"{BACKEND_URL}/query_sse_memory/"
@@ -156,13 +225,7 @@ with col_right:
             for event in sse_stream_post(url, json_data=data, timeout=300):
                 t = event.get("type")
                 if t == "token":
-                    token = event.get("value", "")
-                    final_answer_parts.append(token)
-                    joined = "".join(final_answer_parts)
-                    assistant_placeholder.markdown(
-                        f"<div style='text-align:left; background:#e0e0e0; color:#111; padding:12px; border-radius:12px;'><b>Assistant:</b> {joined}</div>",
-                        unsafe_allow_html=True
-                    )
+                    answer.append(event.get("value", ""))
                 elif t == "sources":
                     st.session_state.sources = event.get("value", [])
                     src_md = "<b>Sources:</b><br>"
@@ -172,14 +235,12 @@ with col_right:
                         src_md += f"- **{filename}** — {preview}...<br>"
                     source_placeholder.markdown(src_md, unsafe_allow_html=True)
                 elif t == "done":
-                    final_answer = "".join(final_answer_parts).strip()
+                    st.session_state.render_stats = answer.finish()
+                    final_answer = answer.text
                     st.session_state.messages.append({"role": "assistant", "content": final_answer})
                     st.session_state.last_assistant = final_answer
                     st.session_state.is_streaming = False
-                    assistant_placeholder.markdown(
-                        f"<div style='text-align:left; background:#e0e0e0; color:#111; padding:12px; border-radius:12px;'><b>Assistant:</b> {final_answer}</div>",
-                        unsafe_allow_html=True
-                    )
+                    render_diagnostics(diagnostics_placeholder)
                     break
         except Exception as e:
             st.error(f"Error during streaming: {e}")